@@ -0,0 +1,221 @@
+import asyncio
+import json
+import logging
+import os
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_DIR = 'analytics'
+
+# Days kept in memory and replayed on startup
+KEEP_DAYS = 30
+
+
+class DayStats:
+    """Counters for one day, updated as events arrive."""
+
+    __slots__ = ('visitors', 'cart_users', 'order_users', 'added', 'cleared', 'orders', 'revenue')
+
+    def __init__(self):
+        self.visitors = set()
+        self.cart_users = set()
+        self.order_users = set()
+        self.added = Counter()    # "category_id_product_id" -> quantity
+        self.cleared = 0
+        self.orders = 0
+        self.revenue = Counter()  # category id -> tiyin
+
+    def apply(self, event):
+        kind, user_id = event['event'], event['user_id']
+        self.visitors.add(user_id)
+        if kind == 'cart_add':
+            self.cart_users.add(user_id)
+            self.added[f"{event['category_id']}_{event['product_id']}"] += event['quantity']
+        elif kind == 'cart_clear':
+            self.cleared += 1
+        elif kind == 'order':
+            self.order_users.add(user_id)
+            self.orders += 1
+            for line in event['lines']:
+                self.revenue[line['category_id']] += line['price'] * line['quantity']
+
+    def update(self, other):
+        self.visitors |= other.visitors
+        self.cart_users |= other.cart_users
+        self.order_users |= other.order_users
+        self.added.update(other.added)
+        self.cleared += other.cleared
+        self.orders += other.orders
+        self.revenue.update(other.revenue)
+
+    def to_dict(self):
+        return {
+            "visitors": list(self.visitors),
+            "cart_users": list(self.cart_users),
+            "order_users": list(self.order_users),
+            "added": self.added,
+            "cleared": self.cleared,
+            "orders": self.orders,
+            "revenue": self.revenue
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.visitors = set(data['visitors'])
+        stats.cart_users = set(data['cart_users'])
+        stats.order_users = set(data['order_users'])
+        stats.added = Counter(data['added'])
+        stats.cleared = data['cleared']
+        stats.orders = data['orders']
+        stats.revenue = Counter(data['revenue'])
+        return stats
+
+
+class Analytics:
+    """Shop events in append-only daily logs, with per-day counters.
+
+    ``record()`` applies an event to the counters of its day and queues it
+    for the log, so a report only adds up the counters of the days it
+    covers and never reads the logs, the users or the carts. Logs are
+    named ``events-<day><suffix>.jsonl``; on startup the last KEEP_DAYS
+    of them are replayed. Queued events are appended by a background
+    task every ``flush_interval`` seconds. With ``summary`` the counters
+    are also saved to ``summary<suffix>.json`` for other processes to
+    merge into their reports.
+    """
+
+    def __init__(self, directory=ANALYTICS_DIR, suffix='', flush_interval=5.0, summary=False):
+        self.directory = directory
+        self.suffix = suffix
+        self.flush_interval = flush_interval
+        self.summary = summary
+        self.days = {}     # date -> DayStats
+        self._pending = []
+        self._task = None
+
+    def _path(self, day):
+        return os.path.join(self.directory, f'events-{day.isoformat()}{self.suffix}.jsonl')
+
+    def summary_path(self):
+        return os.path.join(self.directory, f'summary{self.suffix}.json')
+
+    def load(self):
+        today = date.today()
+        for offset in range(KEEP_DAYS - 1, -1, -1):
+            day = today - timedelta(days=offset)
+            path = self._path(day)
+            if not os.path.exists(path):
+                continue
+            stats = self.days[day] = DayStats()
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        stats.apply(json.loads(line))
+                    except (ValueError, KeyError):
+                        # A line cut short by a crash
+                        continue
+        logger.info('Loaded analytics for %s days', len(self.days))
+
+    def _today(self):
+        today = date.today()
+        stats = self.days.get(today)
+        if stats is None:
+            stats = self.days[today] = DayStats()
+            for day in [day for day in self.days if (today - day).days >= KEEP_DAYS]:
+                del self.days[day]
+        return today, stats
+
+    def record(self, event, user_id, **fields):
+        day, stats = self._today()
+        event = {
+            "event": event,
+            "user_id": user_id,
+            "time": datetime.now().isoformat(timespec='seconds'),
+            **fields
+        }
+        stats.apply(event)
+        self._pending.append((day, event))
+
+    def visit(self, user_id):
+        """Count ``user_id`` as active today; logged once per user and day."""
+        if user_id not in self._today()[1].visitors:
+            self.record('visit', user_id)
+
+    def stats(self, days):
+        """Counters of the last ``days`` days added together."""
+        first = date.today() - timedelta(days=days - 1)
+        total = DayStats()
+        for day, stats in self.days.items():
+            if day >= first:
+                total.update(stats)
+        return total
+
+    def load_summary(self, path, days):
+        """The last ``days`` days of a summary written by another process."""
+        first = (date.today() - timedelta(days=days - 1)).isoformat()
+        total = DayStats()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            return total
+        for day, stats in summary.items():
+            if day >= first:
+                total.update(DayStats.from_dict(stats))
+        return total
+
+    def _write(self, batch, summary):
+        os.makedirs(self.directory, exist_ok=True)
+        lines = {}
+        for day, event in batch:
+            lines.setdefault(day, []).append(json.dumps(event, ensure_ascii=False) + '\n')
+        for day, day_lines in lines.items():
+            with open(self._path(day), 'a', encoding='utf-8') as f:
+                f.write(''.join(day_lines))
+        if summary is not None:
+            path = self.summary_path()
+            with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+                f.write(summary)
+            os.replace(f'{path}.tmp', path)
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        summary = None
+        if self.summary:
+            summary = json.dumps({day.isoformat(): stats.to_dict() for day, stats in self.days.items()})
+        try:
+            await asyncio.to_thread(self._write, batch, summary)
+        except OSError:
+            logger.exception('Failed to write analytics events, will retry')
+            self._pending = batch + self._pending
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+def conversion(stats):
+    """Share of the users who added something to a cart and then ordered, in percent."""
+    if not stats.cart_users:
+        return 0.0
+    return len(stats.order_users & stats.cart_users) * 100 / len(stats.cart_users)
+
@@ -0,0 +1,4 @@
+"""Load-test harness that replays simulated shopper sessions against bot.py.
+
+Run ``python -m bench --help`` for the options.
+"""
@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+from bench.fakes import UpdateFactory, fake_bot
+from bench.results import handler_results
+from bench.scenario import generate_catalog, user_sessions
+from bench.sharded import run_sharded
+
+# Simulated user ids start here so they never collide with ADMIN_ID
+FIRST_USER_ID = 10_000_000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog='python -m bench', description='Replay simulated shopper sessions against bot.py.')
+    parser.add_argument('--users', type=int, default=100, help='concurrent simulated users')
+    parser.add_argument('--sessions', type=int, default=3, help='shopping sessions per user')
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--products', type=int, default=1000, help='catalog size')
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--workers', type=int, default=0,
+                        help='shard users across this many worker processes, as bot.py --workers does')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--out', default='bench_results.json', help='where to write the results')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    return parser.parse_args()
+
+
+async def run(args, bot):
+    from metrics import metrics
+
+    fake, request = fake_bot()
+    application = bot.build_application(fake)
+    errors = []
+
+    async def count_error(update, context):
+        errors.append(repr(context.error))
+
+    application.add_error_handler(count_error)
+
+    await application.initialize()
+    await bot.on_startup(application)
+
+    catalog = generate_catalog(args.categories, args.products)
+    bot.store.replace('products', bot.decode_catalog(catalog))
+    bot.catalog_changed()
+    await bot.store.flush()
+
+    metrics.reset()
+    request.calls.clear()
+    factory = UpdateFactory(fake)
+    updates = 0
+
+    async def shopper(n):
+        nonlocal updates
+        for update in user_sessions(factory, FIRST_USER_ID + n, catalog, args.sessions, args.seed + n):
+            await application.process_update(update)
+            updates += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(shopper(n) for n in range(args.users)))
+    elapsed = time.perf_counter() - start
+
+    # The final flush is part of the cost of the run
+    await bot.on_shutdown(application)
+    await application.shutdown()
+
+    storage = {
+        f"{operation} {name}": {"calls": calls, "bytes": nbytes}
+        for (operation, name), (calls, nbytes) in sorted(metrics.io.items())
+    }
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ('out', 'baseline')},
+        "updates": updates,
+        "errors": len(errors),
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_sec": round(updates / elapsed, 1),
+        "api_calls": dict(sorted(request.calls.items())),
+        "api_calls_per_update": round(sum(request.calls.values()) / max(updates, 1), 2),
+        "bytes_written": sum(v['bytes'] for k, v in storage.items() if k.startswith('save_data')),
+        "handlers": handler_results(metrics),
+        "storage": storage,
+    }
+
+
+def compare(results, baseline):
+    def change(new, old):
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    print(f"updates/sec: {results['updates_per_sec']} ({change(results['updates_per_sec'], baseline['updates_per_sec'])})")
+    print(f"bytes written: {results['bytes_written']} ({change(results['bytes_written'], baseline['bytes_written'])})")
+    for name, stats in results['handlers'].items():
+        old = baseline['handlers'].get(name)
+        if old:
+            print(f"{name} p95: {stats['p95_ms']} ms ({change(stats['p95_ms'], old['p95_ms'])})")
+
+
+def main():
+    args = parse_args()
+    out = os.path.abspath(args.out)
+    baseline = os.path.abspath(args.baseline) if args.baseline else None
+
+    if args.workers:
+        # Workers share one database; the JSON files cannot be shared
+        args.backend = 'sqlite'
+
+    # bot.py keeps its data files in the working directory
+    workdir = tempfile.mkdtemp(prefix='bot-bench-')
+    os.chdir(workdir)
+    os.environ['STORAGE_BACKEND'] = args.backend
+    os.environ['SQLITE_PATH'] = os.path.join(workdir, 'bench.db')
+    # Simulated shoppers tap far faster than people; keep the per-user limit out of the way
+    os.environ.setdefault('USER_RATE', '0')
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    import bot
+    logging.getLogger().setLevel(logging.WARNING)
+    if not args.workers:
+        bot.init()
+
+    if args.workers:
+        results = run_sharded(args, bot, FIRST_USER_ID)
+    else:
+        results = asyncio.run(run(args, bot))
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    print(f"{results['updates']} updates in {results['elapsed_s']} s: {results['updates_per_sec']} updates/sec, "
+          f"{results['api_calls_per_update']} API calls/update, {results['bytes_written']} bytes written, "
+          f"{results['errors']} errors")
+    print(f"Results saved to {out}")
+    if baseline:
+        with open(baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import itertools
+import json
+import time
+from collections import Counter
+
+from telegram import Update
+from telegram.ext import ExtBot
+from telegram.request import BaseRequest
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+
+
+class FakeRequest(BaseRequest):
+    """Answers every Bot API call locally and counts calls per method."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        from metrics import metrics
+
+        endpoint = url.rsplit('/', 1)[-1]
+        self.calls[endpoint] += 1
+        # Counted like the real requests, so each handler's calls show up in its results
+        metrics.observe_api(endpoint, 0.0)
+        params = request_data.parameters if request_data is not None else {}
+        return 200, json.dumps({"ok": True, "result": self._result(endpoint, params)}).encode()
+
+    def _result(self, endpoint, params):
+        if endpoint == 'getMe':
+            return BOT_USER
+        if endpoint.startswith(('send', 'edit')) and 'chat_id' in params:
+            return {
+                "message_id": params.get('message_id') or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(params.get('chat_id', 0)), "type": "private"},
+                "text": params.get('text', ''),
+            }
+        return True
+
+
+def fake_bot():
+    """Return an ExtBot wired to a FakeRequest, and that request."""
+    request = FakeRequest()
+    return ExtBot('123456:bench', request=request, get_updates_request=FakeRequest()), request
+
+
+class UpdateFactory:
+    """Builds Update objects as Telegram would deliver them to the bot."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_ids = itertools.count(1)
+        self._ids = itertools.count(1)
+
+    @staticmethod
+    def _user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}", "language_code": "uz"}
+
+    def _message(self, user_id, text, message_id=None):
+        message = {
+            "message_id": message_id or next(self._ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text,
+        }
+        if text.startswith('/'):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return message
+
+    def message(self, user_id, text):
+        data = {"update_id": next(self._update_ids), "message": self._message(user_id, text)}
+        return Update.de_json(data, self.bot)
+
+    def callback(self, user_id, data, message_id=1):
+        update = {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._ids)),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "message": {**self._message(user_id, '', message_id), "from": BOT_USER},
+                "data": data,
+            },
+        }
+        return Update.de_json(update, self.bot)
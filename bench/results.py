@@ -0,0 +1,13 @@
+def handler_results(metrics):
+    """Latency percentiles and Bot API calls per update for each handler in ``metrics``."""
+    handlers = {}
+    for name, histogram in sorted(metrics.handlers.items()):
+        p50, p95, p99 = histogram.percentiles(0.5, 0.95, 0.99)
+        handlers[name] = {
+            "count": histogram.count,
+            "p50_ms": round(p50 * 1000, 3),
+            "p95_ms": round(p95 * 1000, 3),
+            "p99_ms": round(p99 * 1000, 3),
+            "api_calls_per_update": round(metrics.api_calls_per_update(name), 2),
+        }
+    return handlers
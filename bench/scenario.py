@@ -0,0 +1,52 @@
+import random
+
+
+def generate_catalog(categories, products):
+    """A products document with ``products`` items spread over ``categories``.
+
+    Prices are in tiyin, as the bot stores them.
+    """
+    document = {"categories": {}, "products": {}}
+    for c in range(1, categories + 1):
+        document['categories'][str(c)] = f"Category {c}"
+        document['products'][str(c)] = {}
+    for p in range(products):
+        category_id = str(p % categories + 1)
+        items = document['products'][category_id]
+        items[str(len(items) + 1)] = {
+            "name": f"Product {p + 1}",
+            "price": random.randint(1, 1000) * 100_000,
+            "description": f"Description of product {p + 1}"
+        }
+    return document
+
+
+def shopper_session(factory, user_id, catalog, rng, first=True, checkout=False):
+    """Updates for one visit: browse to a random product, add it, open the cart.
+
+    With ``checkout`` the visit ends by placing an order.
+    """
+    category_id = rng.choice([c for c, items in catalog['products'].items() if items])
+    product_id = rng.choice(list(catalog['products'][category_id]))
+
+    if first:
+        yield factory.message(user_id, '/start')
+        yield factory.callback(user_id, 'lang_uz')
+    else:
+        yield factory.callback(user_id, 'main_menu')
+    yield factory.callback(user_id, 'products')
+    yield factory.callback(user_id, f'cat_{category_id}')
+    yield factory.callback(user_id, f'prod_{category_id}_{product_id}')
+    yield factory.callback(user_id, f'add_{category_id}_{product_id}')
+    yield factory.callback(user_id, 'main_menu')
+    yield factory.callback(user_id, 'catalog')
+    if checkout:
+        yield factory.callback(user_id, 'order')
+        yield factory.message(user_id, f'+998{user_id % 10 ** 9:09d}')
+        yield factory.message(user_id, f'Street {rng.randint(1, 100)}')
+
+
+def user_sessions(factory, user_id, catalog, sessions, seed):
+    rng = random.Random(seed)
+    for n in range(sessions):
+        yield from shopper_session(factory, user_id, catalog, rng, first=n == 0, checkout=n == sessions - 1)
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from queue import Empty
+import time
+from collections import Counter
+
+from bench.fakes import UpdateFactory, fake_bot
+from bench.results import handler_results
+from bench.scenario import generate_catalog, user_sessions
+
+
+def receive(results, workers):
+    """Next message from the workers; raises if one of them died instead."""
+    while True:
+        try:
+            return results.get(timeout=1)
+        except Empty:
+            dead = [worker.name for worker in workers if worker.exitcode not in (None, 0)]
+            if dead:
+                raise RuntimeError(f"worker {', '.join(dead)} failed") from None
+
+
+def shard_worker(index, count, queue, results):
+    import bot
+    from metrics import metrics
+    from sharding import consume
+    from telegram import Update
+
+    logging.getLogger().setLevel(logging.WARNING)
+    bot.configure_shard(index, count)
+    fake, request = fake_bot()
+    application = bot.build_application(fake)
+    errors = []
+
+    async def count_error(update, context):
+        errors.append(repr(context.error))
+
+    application.add_error_handler(count_error)
+
+    async def process(data):
+        await application.process_update(Update.de_json(data, application.bot))
+
+    async def serve():
+        await application.initialize()
+        await bot.on_startup(application)
+        metrics.reset()
+        request.calls.clear()
+        results.put(None)
+        await consume(queue, process)
+        await bot.on_shutdown(application)
+        await application.shutdown()
+
+    asyncio.run(serve())
+    handlers = {
+        name: (histogram.count, histogram.total, list(histogram.samples), metrics.handler_api_calls[name])
+        for name, histogram in metrics.handlers.items()
+    }
+    results.put({"errors": len(errors), "api_calls": dict(request.calls), "io": dict(metrics.io),
+                 "handlers": handlers})
+
+
+def run_sharded(args, bot, first_user_id):
+    """Replay the scenario through worker processes, as ``bot.py --workers`` runs.
+
+    Updates are routed by user id over multiprocessing queues and every
+    worker talks to its own fake Bot API.
+    """
+    from metrics import Histogram, Metrics, SAMPLE_SIZE
+    from sharding import ShardRouter
+    from storage import ALL, SqliteBackend
+
+    # The catalog is shared by all workers through the database
+    catalog = generate_catalog(args.categories, args.products)
+    backend = SqliteBackend(os.environ['SQLITE_PATH'])
+    backend.write('products', backend.encode('products', bot.decode_catalog(catalog), {ALL}))
+    backend.close()
+
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue() for _ in range(args.workers)]
+    results = context.Queue()
+    workers = [context.Process(target=shard_worker, args=(index, args.workers, queue, results))
+               for index, queue in enumerate(queues)]
+    for worker in workers:
+        worker.start()
+    for _ in workers:
+        receive(results, workers)
+
+    # Interleave the shoppers the way concurrent users would arrive
+    factory = UpdateFactory(fake_bot()[0])
+    streams = [user_sessions(factory, first_user_id + n, catalog, args.sessions, args.seed + n)
+               for n in range(args.users)]
+    batches = []
+    while streams:
+        batch = []
+        for stream in list(streams):
+            update = next(stream, None)
+            if update is None:
+                streams.remove(stream)
+            else:
+                batch.append(update.to_dict())
+        if batch:
+            batches.append(batch)
+    updates = sum(len(batch) for batch in batches)
+
+    router = ShardRouter(queues)
+    start = time.perf_counter()
+    for batch in batches:
+        router.dispatch(batch)
+    router.close()
+    reports = [receive(results, workers) for _ in workers]
+    elapsed = time.perf_counter() - start
+    for worker in workers:
+        worker.join()
+
+    api_calls, storage = Counter(), {}
+    # Room for every worker's samples, so the percentiles cover all of them
+    merged = Metrics()
+    merged.handlers.default_factory = lambda: Histogram(SAMPLE_SIZE * len(workers))
+    for report in reports:
+        api_calls.update(report['api_calls'])
+        for name, (count, total, samples, calls) in report['handlers'].items():
+            merged.handlers[name].merge(count, total, samples)
+            merged.handler_api_calls[name] += calls
+        for (operation, name), (calls, nbytes) in report['io'].items():
+            totals = storage.setdefault(f"{operation} {name}", {"calls": 0, "bytes": 0})
+            totals['calls'] += calls
+            totals['bytes'] += nbytes
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ('out', 'baseline')},
+        "updates": updates,
+        "errors": sum(report['errors'] for report in reports),
+        "elapsed_s": round(elapsed, 3),
+        "updates_per_sec": round(updates / elapsed, 1),
+        "api_calls": dict(sorted(api_calls.items())),
+        "api_calls_per_update": round(sum(api_calls.values()) / max(updates, 1), 2),
+        "bytes_written": sum(v['bytes'] for k, v in storage.items() if k.startswith('save_data')),
+        "handlers": handler_results(merged),
+        "storage": dict(sorted(storage.items())),
+    }
@@ -1,17 +1,62 @@
+import time
+
+# Measured from here for --profile-startup
+_import_started = time.perf_counter()
+
 import logging
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputMediaPhoto,
+    InputTextMessageContent,
+    KeyboardButton,
+    ReplyKeyboardMarkup,
+    ReplyKeyboardRemove,
+    Update,
+)
 from telegram.ext import (
-    Updater,
+    Application,
     CommandHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     MessageHandler,
-    Filters,
-    CallbackContext,
+    TypeHandler,
+    ApplicationHandlerStop,
+    filters,
+    ContextTypes,
     ConversationHandler,
+    ExtBot,
 )
+from telegram.request import HTTPXRequest
 from datetime import datetime
-import json
+import argparse
+import asyncio
+import multiprocessing
 import os
+import signal
+import tempfile
+from typing import Optional
+
+from analytics import Analytics, conversion
+from catalog import CatalogIndex, decode_catalog, format_price, paginate, parse_price
+from broadcast import Broadcast
+from cart import Cart, decode_carts
+from catalog_io import apply_import, detect_format, export_catalog, read_import
+from keyboards import MenuCache
+from maintenance import DAY, Maintenance
+from i18n import Translations
+from images import ImageStore
+from metrics import metrics, serve_metrics, timed
+from orders import OrderLog, OrderNotifier
+from outbox import Outbox
+from persistence import StorePersistence
+from search import SearchIndex
+from sharding import ShardRouter, consume, poll_updates, shard_for
+from stock import SharedStock, Stock
+from storage import ALL, DataStore, JsonBackend, SqliteBackend
+from throttle import Throttle
+from webhook import WebhookServer
 
 # Logging configuration
 logging.basicConfig(
@@ -22,7 +67,21 @@ logger = logging.getLogger(__name__)
 
 # Bot states
 SELECT_LANG, MAIN_MENU, CATEGORIES, PRODUCTS, CART, ABOUT = range(6)
-ADMIN, ADD_CATEGORY, ADD_PRODUCT = range(3, 6)
+ADMIN, ADD_CATEGORY, ADD_PRODUCT, IMPORT_CATALOG, BROADCAST = range(6, 11)
+CHECKOUT_PHONE, CHECKOUT_ADDRESS = range(11, 13)
+MANAGE_CATALOG, EDIT_VALUE = range(13, 15)
+
+# Languages offered on /start, each with a locales/<lang>.json catalog
+LANGUAGES = ('uz', 'ru')
+
+# Bot tokenini o'rnating
+BOT_TOKEN = os.getenv('BOT_TOKEN', "8076561745:AAFHdCGcqBQXiST-EXfcWK9uiHUufYm0rA0")
+
+# Bot API server; point it at a local stand-in for testing
+BOT_API_URL = os.getenv('BOT_API_URL', 'https://api.telegram.org/bot')
+
+# Port for the Prometheus /metrics endpoint; 0 disables it
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
 
 # Admin ID - o'zingizning Telegram IDingizni qo'ying
 ADMIN_ID =  7877153414 # Bu yerga o'zingizning IDingizni yozing
@@ -31,211 +90,420 @@ ADMIN_ID =  7877153414 # Bu yerga o'zingizning IDingizni yozing
 USERS_FILE = 'users.json'
 PRODUCTS_FILE = 'products.json'
 CARTS_FILE = 'carts.json'
+STOCK_FILE = 'stock.json'
+PHOTOS_FILE = 'photos.json'
 
-# Initialize data files if they don't exist
-if not os.path.exists(USERS_FILE):
-    with open(USERS_FILE, 'w') as f:
-        json.dump({}, f)
+# Checkpoint of the broadcast in progress, if any
+BROADCAST_FILE = 'broadcast.jsonl'
 
-if not os.path.exists(PRODUCTS_FILE):
-    with open(PRODUCTS_FILE, 'w') as f:
-        json.dump({"categories": {}, "products": {}}, f)
+# Broadcast messages per second
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))
 
-if not os.path.exists(CARTS_FILE):
-    with open(CARTS_FILE, 'w') as f:
-        json.dump({}, f)
+# Append-only log of placed orders
+ORDERS_FILE = 'orders.jsonl'
 
-def load_data(filename):
-    with open(filename, 'r') as f:
-        return json.load(f)
+# Orders arriving within this many seconds reach the admin in one message
+ORDER_BATCH_WINDOW = float(os.getenv('ORDER_BATCH_WINDOW', '2'))
 
-def save_data(data, filename):
-    with open(filename, 'w') as f:
-        json.dump(data, f, indent=4)
+# Compressed archive of the users removed for inactivity
+ARCHIVE_FILE = 'users-archive.jsonl.gz'
 
-# Start command
-def start(update: Update, context: CallbackContext) -> int:
-    user_id = str(update.effective_user.id)
-    users = load_data(USERS_FILE)
-    
-    # Check if user exists
+# Days without a visit before a user is archived, or their cart is emptied; 0 keeps them
+USER_RETENTION_DAYS = float(os.getenv('USER_RETENTION_DAYS', '180'))
+CART_RETENTION_DAYS = float(os.getenv('CART_RETENTION_DAYS', '14'))
+
+# How often (in seconds) the maintenance job runs
+MAINTENANCE_INTERVAL = float(os.getenv('MAINTENANCE_INTERVAL', '86400'))
+
+# A user's last visit is saved at most this often (in seconds)
+LAST_SEEN_RESOLUTION = 3600
+
+# Storage backend: "json" (the files above) or "sqlite"
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'shop.db')
+
+# Write the JSON files without indentation
+JSON_COMPACT = os.getenv('JSON_COMPACT', '0') == '1'
+
+# Updates per second each user may send, and how many may come in a burst; 0 disables the limit
+USER_RATE = float(os.getenv('USER_RATE', '2'))
+USER_BURST = int(os.getenv('USER_BURST', '6'))
+
+# How often (in seconds) changed data is written back to disk
+FLUSH_INTERVAL = float(os.getenv('FLUSH_INTERVAL', '5'))
+
+# Worker processes behind one ingress process; 0 handles everything in this process
+WORKERS = int(os.getenv('BOT_WORKERS', '0'))
+
+# (index, count) inside a worker process, which owns the users with id % count == index
+SHARD = None
+
+# How often (in seconds) a worker checks whether the admin's worker changed the catalog
+CATALOG_POLL_INTERVAL = float(os.getenv('CATALOG_POLL_INTERVAL', '5'))
+
+DATA_FILES = {
+    'users': (USERS_FILE, {}),
+    'products': (PRODUCTS_FILE, {"categories": {}, "products": {}}),
+    'carts': (CARTS_FILE, {}),
+    'stock': (STOCK_FILE, {}),
+    # Telegram file_id of each uploaded product photo, by image path
+    'photos': (PHOTOS_FILE, {}),
+}
+
+# Conversation states and user_data, restored after a restart
+SESSION_FILES = {
+    'conversations': ('conversations.json', {}),
+    'user_data': ('user_data.json', {}),
+}
+
+def owns_user(user_id):
+    return SHARD is None or shard_for(int(user_id), SHARD[1]) == SHARD[0]
+
+def create_backend(files):
+    if STORAGE_BACKEND == 'sqlite':
+        return SqliteBackend(SQLITE_PATH, shard=SHARD)
+    return JsonBackend(files, compact=JSON_COMPACT)
+
+def create_store():
+    # Only the admin edits the catalog, so only the admin's worker writes it
+    read_only = () if owns_user(ADMIN_ID) else ('products',)
+    # Workers share the stock through the database instead of keeping a copy each
+    names = [name for name in DATA_FILES if SHARD is None or name != 'stock']
+    # The catalog is loaded in the background after startup, or on first use if that comes sooner
+    return DataStore(create_backend(DATA_FILES), names, flush_interval=FLUSH_INTERVAL,
+                     decoders={'products': decode_catalog, 'carts': decode_carts}, read_only=read_only,
+                     lazy=('products',))
+
+def create_stock():
+    return Stock(store) if SHARD is None else SharedStock(store.backend)
+
+# Set up by init()
+store = None
+stock = None
+
+# Prebuilt menus and listing index, invalidated whenever the catalog changes
+menus = MenuCache()
+_catalog_index = None
+
+def get_catalog_index():
+    global _catalog_index
+    if _catalog_index is None:
+        _catalog_index = CatalogIndex(store['products'])
+    return _catalog_index
+
+def catalog_changed(category_ids=(ALL,), previous=None):
+    # The search index is rebuilt only when the whole catalog was replaced
+    global _catalog_index, _search
+    _catalog_index = None
+    menus.invalidate()
+    if ALL in category_ids or _search is None or not _search.done():
+        # An index still being built comes from an older snapshot
+        _search = None
+    else:
+        update_search_index(_search.result(), previous, store['products'], category_ids)
+
+def commit_catalog(catalog, category_ids):
+    # Edits are made on a copy and swapped in here, so a shopper never sees half of one;
+    # nothing may be awaited between copying the catalog and committing it
+    previous = store['products']
+    store.replace('products', catalog, category_ids)
+    catalog_changed(category_ids, previous)
+
+# Full-text product search over the current catalog, built on the first search after
+# the catalog is loaded or reloaded and then kept up to date by commit_catalog()
+_search = None
+
+# Maximum number of products listed for a search
+SEARCH_LIMIT = 10
+
+# Product photos, resized in worker processes
+images = ImageStore()
+
+# Telegram rejects photo captions longer than this
+CAPTION_LIMIT = 1024
+
+def build_search_index(catalog):
+    index = SearchIndex()
+    for product in catalog.all_products():
+        if product.available:
+            index.add((product.category_id, product.id), product.name, product.description)
+    return index
+
+def update_search_index(index, previous, catalog, category_ids):
+    # Products are replaced, never changed in place, so only new or removed ones are re-indexed
+    for category_id in category_ids:
+        old, new = previous.products(category_id), catalog.products(category_id)
+        for product_id in old.keys() - new.keys():
+            index.remove((category_id, product_id))
+        for product_id, product in new.items():
+            if old.get(product_id) is product:
+                continue
+            if product.available:
+                index.add((category_id, product_id), product.name, product.description)
+            else:
+                index.remove((category_id, product_id))
+
+async def get_search_index():
+    # Catalog snapshots are never changed in place, so the index is built in a thread
+    global _search
+    while True:
+        if _search is None:
+            _search = asyncio.ensure_future(asyncio.to_thread(build_search_index, store['products']))
+        search = _search
+        index = await search
+        # Dropped by a catalog change while it was built; build it again from the new catalog
+        if search is _search:
+            return index
+
+# Days covered by the admin's analytics report, and how many products it lists
+REPORT_DAYS = 7
+TOP_PRODUCTS = 10
+
+def create_analytics():
+    if SHARD is None:
+        return Analytics(flush_interval=FLUSH_INTERVAL)
+    # The admin's worker adds the other workers' summaries to its report
+    return Analytics(suffix=f'.{SHARD[0]}', flush_interval=FLUSH_INTERVAL, summary=True)
+
+analytics = None
+
+# Message catalogs for every language, read by init()
+texts = None
+
+def user_lang(user_id):
+    user = store['users'].get(user_id)
+    return user['lang'] if user else None
+
+def price_text(lang, price):
+    return texts.get(lang, 'price', amount=format_price(price))
+
+async def replace_text(query, text, reply_markup=None):
+    if query.message is not None and query.message.photo:
+        # A photo cannot be edited into text, so it is replaced
+        await query.message.reply_text(text=text, reply_markup=reply_markup)
+        await query.message.delete()
+    else:
+        await query.edit_message_text(text=text, reply_markup=reply_markup)
+
+# Edits of the message a button was pressed on; only a handler's last edit of it is sent
+outbox = Outbox(replace_text)
+
+async def edit_text(query, text, reply_markup=None):
+    await outbox.edit(query, text, reply_markup)
+
+def ensure_user(user_id):
+    users = store['users']
     if user_id not in users:
         users[user_id] = {
             "lang": None,
-            "cart": []
+            "cart": [],
+            "last_seen": int(time.time())
         }
-        save_data(users, USERS_FILE)
+        store.mark_dirty('users', user_id)
+    return users[user_id]
+
+# Start command
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    user_id = str(update.effective_user.id)
     
+    # Register the user on the first visit
+    ensure_user(user_id)
+    
+    keyboard = [
+        [InlineKeyboardButton(texts.get(lang, 'language.name'), callback_data=f'lang_{lang}')]
+        for lang in LANGUAGES
+    ]
     # Check if admin
     if update.effective_user.id == ADMIN_ID:
-        keyboard = [
-            [InlineKeyboardButton("🇺🇿 O'zbekcha", callback_data='lang_uz')],
-            [InlineKeyboardButton("🇷🇺 Русский", callback_data='lang_ru')],
-            [InlineKeyboardButton("👑 Admin", callback_data='admin')]
-        ]
-    else:
-        keyboard = [
-            [InlineKeyboardButton("🇺🇿 O'zbekcha", callback_data='lang_uz')],
-            [InlineKeyboardButton("🇷🇺 Русский", callback_data='lang_ru')]
-        ]
+        keyboard.append([InlineKeyboardButton("👑 Admin", callback_data='admin')])
     
     reply_markup = InlineKeyboardMarkup(keyboard)
-    update.message.reply_text(
-        "Tilni tanlang / Выберите язык:",
+    await update.message.reply_text(
+        ' / '.join(texts.get(lang, 'language.choose') for lang in LANGUAGES) + ':',
         reply_markup=reply_markup
     )
     
     return SELECT_LANG
 
 # Language selection
-def select_lang(update: Update, context: CallbackContext) -> int:
+async def select_lang(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    query.answer()
+    await query.answer()
     
     user_id = str(query.from_user.id)
-    users = load_data(USERS_FILE)
-    
-    if query.data == 'lang_uz':
-        users[user_id]['lang'] = 'uz'
-        text = "O'zbek tili tanlandi."
-    elif query.data == 'lang_ru':
-        users[user_id]['lang'] = 'ru'
-        text = "Выбран русский язык."
-    elif query.data == 'admin':
+    
+    if query.data == 'admin':
         if query.from_user.id == ADMIN_ID:
-            return admin_panel(update, context)
+            return await admin_panel(update, context)
         else:
-            query.edit_message_text(text="Siz admin emassiz!")
+            await edit_text(query, texts.get(user_lang(user_id), 'not_admin'))
             return ConversationHandler.END
     
-    save_data(users, USERS_FILE)
+    lang = query.data.split('_', 1)[1]
+    if lang in LANGUAGES:
+        ensure_user(user_id)['lang'] = lang
+        store.mark_dirty('users', user_id)
     
     # Show main menu
-    return main_menu(update, context)
+    return await main_menu(update, context)
 
-def main_menu(update: Update, context: CallbackContext) -> int:
-    query = update.callback_query
-    user_id = str(query.from_user.id)
-    users = load_data(USERS_FILE)
-    lang = users[user_id]['lang']
-    
-    if lang == 'uz':
-        text = "Asosiy menyu:"
-        buttons = [
-            ["🛒 Savat", "catalog"],
-            ["📦 Mahsulotlar", "products"],
-            ["🏪 Do'kon haqida", "about"],
-        ]
-    else:
-        text = "Главное меню:"
-        buttons = [
-            ["🛒 Корзина", "catalog"],
-            ["📦 Товары", "products"],
-            ["🏪 О магазине", "about"],
-        ]
+def build_main_menu(lang):
+    text = texts.get(lang, 'main_menu.title')
+    buttons = [
+        [texts.get(lang, 'main_menu.cart'), "catalog"],
+        [texts.get(lang, 'main_menu.products'), "products"],
+        [texts.get(lang, 'main_menu.about'), "about"],
+    ]
     
     keyboard = [[InlineKeyboardButton(btn[0], callback_data=btn[1])] for btn in buttons]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    lang = user_lang(str(update.effective_user.id))
+    
+    text, reply_markup = menus.get(build_main_menu, lang)
     
     if query:
-        query.edit_message_text(text=text, reply_markup=reply_markup)
+        await edit_text(query, text, reply_markup)
     else:
-        update.message.reply_text(text=text, reply_markup=reply_markup)
+        await update.message.reply_text(text=text, reply_markup=reply_markup)
     
     return MAIN_MENU
 
-def show_categories(update: Update, context: CallbackContext) -> int:
-    query = update.callback_query
-    query.answer()
+def page_buttons(lang, page, page_count, callback_prefix):
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(
+            texts.get(lang, 'page.previous'), callback_data=f'{callback_prefix}_p{page - 1}'))
+    if page < page_count - 1:
+        buttons.append(InlineKeyboardButton(
+            texts.get(lang, 'page.next'), callback_data=f'{callback_prefix}_p{page + 1}'))
+    return buttons
+
+def parse_page(data):
+    # "cat_3_p2" / "products_p2" -> 2, anything without a page suffix -> 0
+    last = data.rsplit('_', 1)[-1]
+    return int(last[1:]) if last[:1] == 'p' and last[1:].isdigit() else 0
+
+def clamp_page(ids, page):
+    # Pages past the end from stale or forged buttons share the last page's cache entry
+    return paginate(ids, page)[1]
+
+def build_categories(lang, page):
+    catalog = store['products']
+    category_ids, page, page_count = paginate(get_catalog_index().category_ids, page)
     
-    user_id = str(query.from_user.id)
-    users = load_data(USERS_FILE)
-    lang = users[user_id]['lang']
-    products_data = load_data(PRODUCTS_FILE)
-    categories = products_data['categories']
-    
-    if lang == 'uz':
-        text = "Kategoriyalar:"
-        back_text = "🔙 Orqaga"
-    else:
-        text = "Категории:"
-        back_text = "🔙 Назад"
+    text = texts.get(lang, 'categories.title')
+    back_text = texts.get(lang, 'back')
     
-    if not categories:
-        text = "Hozircha kategoriyalar mavjud emas." if lang == 'uz' else "Категории пока отсутствуют."
+    if not category_ids:
+        text = texts.get(lang, 'categories.empty')
         keyboard = [[InlineKeyboardButton(back_text, callback_data='main_menu')]]
     else:
+        if page_count > 1:
+            text = texts.get(lang, 'page.number', title=text, page=page + 1, page_count=page_count)
         keyboard = []
-        for cat_id, cat_name in categories.items():
-            keyboard.append([InlineKeyboardButton(cat_name, callback_data=f'cat_{cat_id}')])
+        for cat_id in category_ids:
+            keyboard.append([InlineKeyboardButton(catalog.category(cat_id).name, callback_data=f'cat_{cat_id}')])
+        navigation = page_buttons(lang, page, page_count, 'products')
+        if navigation:
+            keyboard.append(navigation)
         keyboard.append([InlineKeyboardButton(back_text, callback_data='main_menu')])
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    query.edit_message_text(text=text, reply_markup=reply_markup)
-    
-    return CATEGORIES
+    return text, InlineKeyboardMarkup(keyboard)
 
-def show_products(update: Update, context: CallbackContext) -> int:
+async def show_categories(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    query.answer()
+    await query.answer()
     
     user_id = str(query.from_user.id)
-    users = load_data(USERS_FILE)
-    lang = users[user_id]['lang']
-    products_data = load_data(PRODUCTS_FILE)
-    category_id = query.data.split('_')[1]
-    products = products_data['products'].get(category_id, {})
+    lang = user_lang(user_id)
     
-    if lang == 'uz':
-        text = f"{products_data['categories'][category_id]} kategoriyasidagi mahsulotlar:"
-        back_text = "🔙 Orqaga"
-        add_to_cart = "🛒 Savatga qo'shish"
-    else:
-        text = f"Товары категории {products_data['categories'][category_id]}:"
-        back_text = "🔙 Назад"
-        add_to_cart = "🛒 В корзину"
+    page = clamp_page(get_catalog_index().category_ids, parse_page(query.data))
+    text, reply_markup = menus.get(build_categories, lang, page)
+    await edit_text(query, text, reply_markup)
     
-    if not products:
-        text = "Hozircha mahsulotlar mavjud emas." if lang == 'uz' else "Товары пока отсутствуют."
+    return CATEGORIES
+
+def build_products(lang, category_id, page):
+    catalog = store['products']
+    category_name = catalog.category(category_id).name
+    products = catalog.products(category_id)
+    product_ids, page, page_count = paginate(get_catalog_index().products(category_id), page)
+    
+    text = texts.get(lang, 'products.title', category=category_name)
+    back_text = texts.get(lang, 'back')
+    
+    if not product_ids:
+        text = texts.get(lang, 'products.empty')
         keyboard = [[InlineKeyboardButton(back_text, callback_data='products')]]
     else:
+        if page_count > 1:
+            text = texts.get(lang, 'page.number', title=text, page=page + 1, page_count=page_count)
         keyboard = []
-        for prod_id, prod_info in products.items():
-            product_text = f"{prod_info['name']} - {prod_info['price']} so'm"
+        for prod_id in product_ids:
+            prod_info = products[prod_id]
+            product_text = texts.get(lang, 'products.button', name=prod_info.name, price=price_text(lang, prod_info.price))
             keyboard.append([
                 InlineKeyboardButton(product_text, callback_data=f'prod_{category_id}_{prod_id}')
             ])
+        navigation = page_buttons(lang, page, page_count, f'cat_{category_id}')
+        if navigation:
+            keyboard.append(navigation)
         keyboard.append([InlineKeyboardButton(back_text, callback_data='products')])
     
-    reply_markup = InlineKeyboardMarkup(keyboard)
-    query.edit_message_text(text=text, reply_markup=reply_markup)
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def show_products(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    user_id = str(query.from_user.id)
+    lang = user_lang(user_id)
+    category_id = query.data.split('_')[1]
+    
+    if store['products'].category(category_id) is None:
+        # Deleted since the message was sent
+        await query.answer(texts.get(lang, 'products.unavailable'), show_alert=True)
+        text, reply_markup = menus.get(build_categories, lang, 0)
+        await edit_text(query, text, reply_markup)
+        return CATEGORIES
+    
+    await query.answer()
+    
+    page = clamp_page(get_catalog_index().products(category_id), parse_page(query.data))
+    text, reply_markup = menus.get(build_products, lang, category_id, page)
+    await edit_text(query, text, reply_markup)
     
     return PRODUCTS
 
-def product_detail(update: Update, context: CallbackContext) -> int:
+def product_text(lang, product):
+    return texts.get(
+        lang, 'product.details',
+        name=product.name,
+        price=price_text(lang, product.price),
+        description=product.description or texts.get(lang, 'product.no_description')
+    )
+
+async def product_detail(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    query.answer()
-    
     user_id = str(query.from_user.id)
-    users = load_data(USERS_FILE)
-    lang = users[user_id]['lang']
-    products_data = load_data(PRODUCTS_FILE)
+    lang = user_lang(user_id)
     
     _, category_id, product_id = query.data.split('_')
-    product = products_data['products'][category_id][product_id]
-    
-    if lang == 'uz':
-        text = (f"🛍 Mahsulot: {product['name']}\n"
-                f"💵 Narxi: {product['price']} so'm\n"
-                f"📝 Tavsif: {product.get('description', 'Mavjud emas')}")
-        add_to_cart = "🛒 Savatga qo'shish"
-        back_text = "🔙 Orqaga"
-    else:
-        text = (f"🛍 Товар: {product['name']}\n"
-                f"💵 Цена: {product['price']} сум\n"
-                f"📝 Описание: {product.get('description', 'Нет описания')}")
-        add_to_cart = "🛒 В корзину"
-        back_text = "🔙 Назад"
+    product = store['products'].product(category_id, product_id)
+    
+    if product is None or not product.available:
+        await query.answer(texts.get(lang, 'product.unavailable'), show_alert=True)
+        return PRODUCTS
+    
+    await query.answer()
+    
+    text = product_text(lang, product)
+    left = await stock.left(category_id, product_id)
+    if left is not None:
+        text += "\n" + (texts.get(lang, 'product.stock', count=left) if left else texts.get(lang, 'product.sold_out'))
+    add_to_cart = texts.get(lang, 'product.add_to_cart')
+    back_text = texts.get(lang, 'back')
     
     keyboard = [
         [InlineKeyboardButton(add_to_cart, callback_data=f'add_{category_id}_{product_id}')],
@@ -243,356 +511,1141 @@ def product_detail(update: Update, context: CallbackContext) -> int:
     ]
     
     reply_markup = InlineKeyboardMarkup(keyboard)
-    query.edit_message_text(text=text, reply_markup=reply_markup)
+    if product.image or product.image_file_id:
+        await show_product_photo(query, product, text[:CAPTION_LIMIT], reply_markup)
+    else:
+        await edit_text(query, text, reply_markup)
     
     return PRODUCTS
 
-def add_to_cart(update: Update, context: CallbackContext) -> int:
-    query = update.callback_query
-    query.answer()
+async def show_product_photo(query, product, caption, reply_markup):
+    # The file is uploaded on the first view only; later views send Telegram's file_id
+    file_id = product.image_file_id or store['photos'].get(product.image)
+    photo = file_id or await asyncio.to_thread(images.read, product.image)
+    if query.message.photo:
+        message = await query.edit_message_media(InputMediaPhoto(photo, caption=caption), reply_markup=reply_markup)
+    else:
+        message = await query.message.reply_photo(photo, caption=caption, reply_markup=reply_markup)
+        await query.message.delete()
+    if file_id is None:
+        # Kept apart from the catalog, so every worker can save it without the catalog changing
+        store['photos'][product.image] = message.photo[-1].file_id
+        store.mark_dirty('photos', product.image)
+
+async def find_products(text):
+    search_index = await get_search_index()
+    catalog = store['products']
+    keys = search_index.search(text)
+    results = [(key, catalog.product(*key)) for key in keys]
+    results.sort(key=lambda result: result[1].name.casefold())
+    return results[:SEARCH_LIMIT]
+
+async def search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Optional[int]:
+    user_id = str(update.effective_user.id)
+    lang = ensure_user(user_id)['lang']
+    text = ' '.join(context.args)
     
-    user_id = str(query.from_user.id)
-    users = load_data(USERS_FILE)
-    lang = users[user_id]['lang']
-    products_data = load_data(PRODUCTS_FILE)
-    carts = load_data(CARTS_FILE)
+    if not text:
+        await update.message.reply_text(texts.get(lang, 'search.usage'))
+        # Stay in the current state
+        return None
     
-    if user_id not in carts:
-        carts[user_id] = []
+    results = await find_products(text)
+    reply = texts.get(lang, 'search.results' if results else 'search.no_results')
+    back_text = texts.get(lang, 'main_menu.back')
+    
+    keyboard = []
+    for (category_id, product_id), product in results:
+        keyboard.append([InlineKeyboardButton(
+            texts.get(lang, 'products.button', name=product.name, price=price_text(lang, product.price)),
+            callback_data=f'prod_{category_id}_{product_id}'
+        )])
+    keyboard.append([InlineKeyboardButton(back_text, callback_data='main_menu')])
+    
+    await update.message.reply_text(reply, reply_markup=InlineKeyboardMarkup(keyboard))
+    return PRODUCTS
+
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    inline_query = update.inline_query
+    user = store['users'].get(str(inline_query.from_user.id))
+    if user:
+        lang = user['lang']
+    else:
+        # Not registered yet; follow the Telegram app language
+        language_code = inline_query.from_user.language_code
+        lang = language_code if language_code in LANGUAGES else 'uz'
+    
+    results = []
+    if inline_query.query.strip():
+        for (category_id, product_id), product in await find_products(inline_query.query):
+            results.append(InlineQueryResultArticle(
+                id=f'{category_id}_{product_id}',
+                title=product.name,
+                description=price_text(lang, product.price),
+                input_message_content=InputTextMessageContent(product_text(lang, product))
+            ))
+    
+    # Results are in the user's language, so Telegram must not share them between users
+    await inline_query.answer(results, cache_time=10, is_personal=True)
+
+async def add_to_cart(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    user_id = str(query.from_user.id)
+    lang = user_lang(user_id)
+    carts = store['carts']
     
     _, category_id, product_id = query.data.split('_')
-    product = products_data['products'][category_id][product_id]
+    product = store['products'].product(category_id, product_id)
+    
+    if product is None or not product.available:
+        await query.answer(texts.get(lang, 'product.unavailable'), show_alert=True)
+        return PRODUCTS
+    if not await stock.take(category_id, product_id):
+        await query.answer(texts.get(lang, 'product.sold_out'), show_alert=True)
+        return PRODUCTS
+    
+    await query.answer(texts.get(lang, 'cart.added'))
+    
+    if user_id not in carts:
+        carts[user_id] = Cart()
     
     # Add product to cart
-    carts[user_id].append({
-        "category_id": category_id,
-        "product_id": product_id,
-        "name": product['name'],
-        "price": product['price'],
-        "quantity": 1
-    })
-    
-    save_data(carts, CARTS_FILE)
-    
-    if lang == 'uz':
-        text = "Mahsulot savatga qo'shildi!"
-    else:
-        text = "Товар добавлен в корзину!"
+    key = carts[user_id].add(category_id, product_id, product.name, product.price)
+    store.mark_dirty('carts', (user_id, key))
+    analytics.record('cart_add', user_id, category_id=category_id, product_id=product_id, quantity=1)
     
-    query.edit_message_text(text=text)
-    return show_cart(update, context)
+    return await show_cart(update, context)
 
-def show_cart(update: Update, context: CallbackContext) -> int:
+async def show_cart(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     user_id = str(query.from_user.id)
-    users = load_data(USERS_FILE)
-    lang = users[user_id]['lang']
-    carts = load_data(CARTS_FILE)
-    user_cart = carts.get(user_id, [])
-    
-    if lang == 'uz':
-        text = "🛒 Savat:\n\n"
-        total_text = "Jami:"
-        empty_text = "Savat bo'sh"
-        back_text = "🔙 Orqaga"
-        clear_text = "🧹 Savatni tozalash"
-        order_text = "🚖 Buyurtma berish"
-    else:
-        text = "🛒 Корзина:\n\n"
-        total_text = "Итого:"
-        empty_text = "Корзина пуста"
-        back_text = "🔙 Назад"
-        clear_text = "🧹 Очистить корзину"
-        order_text = "🚖 Оформить заказ"
+    lang = user_lang(user_id)
+    carts = store['carts']
+    user_cart = carts.get(user_id)
+    
+    back_text = texts.get(lang, 'back')
     
     if not user_cart:
-        text = empty_text
+        text = texts.get(lang, 'cart.empty')
         keyboard = [[InlineKeyboardButton(back_text, callback_data='main_menu')]]
     else:
-        total = 0
-        for item in user_cart:
-            text += f"📦 {item['name']} - {item['price']} so'm x {item['quantity']}\n"
-            total += int(item['price']) * item['quantity']
+        text = texts.get(lang, 'cart.title') + "\n\n"
+        keyboard = []
+        for key, item in user_cart:
+            text += texts.get(lang, 'cart.line', name=item['name'], price=price_text(lang, item['price']),
+                              quantity=item['quantity']) + "\n"
+            keyboard.append([
+                InlineKeyboardButton(f"➖ {item['name']}", callback_data=f'dec_{key}'),
+                InlineKeyboardButton("➕", callback_data=f'inc_{key}'),
+                InlineKeyboardButton("❌", callback_data=f'rm_{key}')
+            ])
         
-        text += f"\n{total_text} {total} so'm"
+        text += "\n" + texts.get(lang, 'cart.total', total=price_text(lang, user_cart.total))
         
-        keyboard = [
-            [InlineKeyboardButton(order_text, callback_data='order')],
-            [InlineKeyboardButton(clear_text, callback_data='clear_cart')],
+        keyboard += [
+            [InlineKeyboardButton(texts.get(lang, 'cart.order'), callback_data='order')],
+            [InlineKeyboardButton(texts.get(lang, 'cart.clear'), callback_data='clear_cart')],
             [InlineKeyboardButton(back_text, callback_data='main_menu')]
         ]
     
     reply_markup = InlineKeyboardMarkup(keyboard)
-    query.edit_message_text(text=text, reply_markup=reply_markup)
+    await edit_text(query, text, reply_markup)
     
     return CART
 
-def clear_cart(update: Update, context: CallbackContext) -> int:
+async def change_cart_item(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    query.answer()
+    user_id = str(query.from_user.id)
+    user_cart = store['carts'].get(user_id)
+    action, key = query.data.split('_', 1)
+    line = user_cart.lines.get(key) if user_cart is not None else None
+    
+    if line is not None:
+        category_id, product_id = line['category_id'], line['product_id']
+        if action == 'inc':
+            product = store['products'].product(category_id, product_id)
+            if product is None or not product.available:
+                await query.answer(texts.get(user_lang(user_id), 'product.unavailable'), show_alert=True)
+                return CART
+            if not await stock.take(category_id, product_id):
+                await query.answer(texts.get(user_lang(user_id), 'product.sold_out'), show_alert=True)
+                return CART
+            user_cart.change(key, 1)
+        elif action == 'dec':
+            user_cart.change(key, -1)
+            await stock.put_back(category_id, product_id)
+        else:
+            quantity = line['quantity']
+            user_cart.remove(key)
+            await stock.put_back(category_id, product_id, quantity)
+        store.mark_dirty('carts', (user_id, key))
     
+    await query.answer()
+    return await show_cart(update, context)
+
+async def clear_cart(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
     user_id = str(query.from_user.id)
-    carts = load_data(CARTS_FILE)
-    users = load_data(USERS_FILE)
-    lang = users[user_id]['lang']
+    carts = store['carts']
+    lang = user_lang(user_id)
+    
+    if user_id in carts:
+        lines = [line for _, line in carts[user_id]]
+        carts[user_id].clear()
+        store.mark_dirty('carts', user_id)
+        for line in lines:
+            await stock.put_back(line['category_id'], line['product_id'], line['quantity'])
+    analytics.record('cart_clear', user_id)
+    
+    await query.answer(texts.get(lang, 'cart.cleared'))
+    return await show_cart(update, context)
+
+def order_text(order, lang):
+    lines = [texts.get(lang, 'order.header', id=order['id'], phone=order['phone'], address=order['address'])]
+    for line in order['lines']:
+        lines.append(texts.get(lang, 'cart.line', name=line['name'], price=price_text(lang, line['price']),
+                               quantity=line['quantity']))
+    lines.append(texts.get(lang, 'cart.total', total=price_text(lang, order['total'])))
+    return '\n'.join(lines)
+
+def admin_order_text(order):
+    return order_text(order, user_lang(str(ADMIN_ID)))
+
+async def refresh_cart(user_id, user_cart, lang):
+    # Brings the cart in line with the catalog: products hidden or deleted since they were
+    # added are removed, changed prices are applied. Returns a notice, or None if nothing changed
+    catalog = store['products']
+    removed, repriced = [], []
+    for key, line in list(user_cart):
+        product = catalog.product(line['category_id'], line['product_id'])
+        if product is None or not product.available:
+            user_cart.remove(key)
+            removed.append(line)
+        elif product.price != line['price']:
+            user_cart.reprice(key, product.price)
+            repriced.append(line)
+        else:
+            continue
+        store.mark_dirty('carts', (user_id, key))
+    for line in removed:
+        await stock.put_back(line['category_id'], line['product_id'], line['quantity'])
+    
+    if not (removed or repriced):
+        return None
+    notices = []
+    if removed:
+        notices.append(texts.get(lang, 'cart.unavailable', names=', '.join(line['name'] for line in removed)))
+    if repriced:
+        notices.append(texts.get(lang, 'cart.repriced', names=', '.join(line['name'] for line in repriced)))
+    notices.append(texts.get(lang, 'cart.check_again'))
+    return '\n'.join(notices)
+
+async def checkout(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    
+    user_id = str(query.from_user.id)
+    lang = user_lang(user_id)
+    user_cart = store['carts'].get(user_id)
+    
+    notice = await refresh_cart(user_id, user_cart, lang) if user_cart else None
+    if notice:
+        # Alerts are limited to 200 characters
+        await query.answer(notice[:200], show_alert=True)
+        return await show_cart(update, context)
+    
+    await query.answer()
+    
+    if not user_cart:
+        return await show_cart(update, context)
     
-    carts[user_id] = []
-    save_data(carts, CARTS_FILE)
+    text = texts.get(lang, 'checkout.phone')
+    reply_markup = ReplyKeyboardMarkup(
+        [[KeyboardButton(texts.get(lang, 'checkout.send_contact'), request_contact=True)]],
+        resize_keyboard=True,
+        one_time_keyboard=True
+    )
+    await query.message.reply_text(text=text, reply_markup=reply_markup)
     
-    if lang == 'uz':
-        text = "Savat tozalandi!"
+    return CHECKOUT_PHONE
+
+async def checkout_phone(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    user_id = str(update.message.from_user.id)
+    lang = user_lang(user_id)
+    
+    if update.message.contact:
+        phone = update.message.contact.phone_number
     else:
-        text = "Корзина очищена!"
+        phone = update.message.text.strip()
+    
+    if not 7 <= sum(c.isdigit() for c in phone) <= 15:
+        await update.message.reply_text(texts.get(lang, 'checkout.bad_phone'))
+        return CHECKOUT_PHONE
     
-    query.edit_message_text(text=text)
-    return show_cart(update, context)
+    context.user_data['checkout_phone'] = phone
+    
+    await update.message.reply_text(texts.get(lang, 'checkout.address'), reply_markup=ReplyKeyboardRemove())
+    return CHECKOUT_ADDRESS
+
+async def checkout_address(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    user_id = str(update.message.from_user.id)
+    lang = user_lang(user_id)
+    user_cart = store['carts'].get(user_id)
+    phone = context.user_data.pop('checkout_phone', None)
+    
+    if not user_cart or phone is None:
+        await update.message.reply_text(texts.get(lang, 'cart.empty'))
+        return await main_menu(update, context)
+    
+    # The admin may have changed the catalog while the user was typing
+    notice = await refresh_cart(user_id, user_cart, lang)
+    if notice:
+        await update.message.reply_text(notice)
+        return await main_menu(update, context)
+    
+    # The order is on disk before the user sees the confirmation; the admin is told in the background
+    order = await order_log.create(user_id, phone, update.message.text.strip(), user_cart)
+    user_cart.clear()
+    store.mark_dirty('carts', user_id)
+    if _order_notifier is not None:
+        _order_notifier.submit(order)
+    analytics.record('order', user_id, order_id=order['id'], total=order['total'], lines=[
+        {"category_id": line['category_id'], "price": line['price'], "quantity": line['quantity']}
+        for line in order['lines']
+    ])
+    
+    text = texts.get(lang, 'checkout.done', id=order['id'])
+    await update.message.reply_text(text + "\n\n" + order_text(order, lang))
+    return await main_menu(update, context)
 
-def about_shop(update: Update, context: CallbackContext) -> int:
+async def about_shop(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    query.answer()
+    await query.answer()
     
     user_id = str(query.from_user.id)
-    users = load_data(USERS_FILE)
-    lang = users[user_id]['lang']
-    
-    if lang == 'uz':
-        text = ("🏪 Bizning do'kon haqida:\n\n"
-                "Biz eng yaxshi mahsulotlarni eng arzon narxlarda taklif qilamiz!\n"
-                "Ish vaqti: 09:00 - 21:00\n"
-                "Telefon: +998906037222")
-        back_text = "🔙 Orqaga"
-    else:
-        text = ("🏪 О нашем магазине:\n\n"
-                "Мы предлагаем лучшие товары по самым низким ценам!\n"
-                "Время работы: 09:00 - 21:00\n"
-                "Телефон: +998906067222")
-        back_text = "🔙 Назад"
+    lang = user_lang(user_id)
     
-    keyboard = [[InlineKeyboardButton(back_text, callback_data='main_menu')]]
+    text = texts.get(lang, 'about.text')
+    keyboard = [[InlineKeyboardButton(texts.get(lang, 'back'), callback_data='main_menu')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    query.edit_message_text(text=text, reply_markup=reply_markup)
+    await edit_text(query, text, reply_markup)
     
     return ABOUT
 
-def admin_panel(update: Update, context: CallbackContext) -> int:
+def build_admin_panel(lang):
+    text = texts.get(lang, 'admin.title')
+    buttons = [
+        [texts.get(lang, 'admin.add_category'), "add_category"],
+        [texts.get(lang, 'admin.add_product'), "add_product"],
+        [texts.get(lang, 'admin.manage'), "manage"],
+        [texts.get(lang, 'admin.import'), "import_catalog"],
+        [texts.get(lang, 'admin.export_csv'), "export_csv"],
+        [texts.get(lang, 'admin.export_jsonl'), "export_jsonl"],
+        [texts.get(lang, 'admin.broadcast'), "broadcast"],
+        [texts.get(lang, 'admin.analytics'), "analytics"],
+        [texts.get(lang, 'main_menu.back'), "main_menu"]
+    ]
+    
+    keyboard = [[InlineKeyboardButton(btn[0], callback_data=btn[1])] for btn in buttons]
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    query.answer()
+    await query.answer()
     
     user_id = str(query.from_user.id)
-    users = load_data(USERS_FILE)
-    lang = users[user_id]['lang']
-    
-    if lang == 'uz':
-        text = "👑 Admin paneli:"
-        buttons = [
-            ["📦 Kategoriya qo'shish", "add_category"],
-            ["🛍 Mahsulot qo'shish", "add_product"],
-            ["🔙 Asosiy menyu", "main_menu"]
-        ]
-    else:
-        text = "👑 Админ панель:"
-        buttons = [
-            ["📦 Добавить категорию", "add_category"],
-            ["🛍 Добавить товар", "add_product"],
-            ["🔙 Главное меню", "main_menu"]
-        ]
+    lang = user_lang(user_id)
     
-    keyboard = [[InlineKeyboardButton(btn[0], callback_data=btn[1])] for btn in buttons]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    text, reply_markup = menus.get(build_admin_panel, lang)
+    await edit_text(query, text, reply_markup)
     
-    query.edit_message_text(text=text, reply_markup=reply_markup)
+    return ADMIN
+
+async def analytics_stats(days):
+    stats = analytics.stats(days)
+    if SHARD is not None:
+        for index in range(SHARD[1]):
+            if index != SHARD[0]:
+                path = os.path.join(analytics.directory, f'summary.{index}.json')
+                stats.update(await asyncio.to_thread(analytics.load_summary, path, days))
+    return stats
+
+def analytics_text(lang, today, period):
+    catalog = store['products']
+    text = texts.get(lang, 'analytics.title', days=REPORT_DAYS) + "\n\n"
+    text += texts.get(lang, 'analytics.active', today=len(today.visitors), period=len(period.visitors)) + "\n"
+    text += texts.get(lang, 'analytics.conversion', carts=len(period.cart_users), orders=period.orders,
+                      rate=f"{conversion(period):.1f}") + "\n"
+    text += texts.get(lang, 'analytics.cleared', count=period.cleared) + "\n\n"
+    
+    text += texts.get(lang, 'analytics.top_products') + "\n"
+    for rank, (key, quantity) in enumerate(period.added.most_common(TOP_PRODUCTS), 1):
+        product = catalog.product(*key.split('_', 1))
+        text += texts.get(lang, 'analytics.top_line', rank=rank, name=product.name if product else key,
+                          quantity=quantity) + "\n"
+    if not period.added:
+        text += texts.get(lang, 'analytics.none') + "\n"
+    
+    text += "\n" + texts.get(lang, 'analytics.revenue') + "\n"
+    for category_id, amount in period.revenue.most_common():
+        category = catalog.category(category_id)
+        text += texts.get(lang, 'analytics.revenue_line', name=category.name if category else category_id,
+                          amount=price_text(lang, amount)) + "\n"
+    if not period.revenue:
+        text += texts.get(lang, 'analytics.none')
+    return text
+
+async def show_analytics(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return ConversationHandler.END
+    
+    lang = user_lang(str(query.from_user.id))
+    text = analytics_text(lang, await analytics_stats(1), await analytics_stats(REPORT_DAYS))
+    keyboard = [[InlineKeyboardButton(texts.get(lang, 'back'), callback_data='admin')]]
+    await edit_text(query, text, InlineKeyboardMarkup(keyboard))
     
     return ADMIN
 
-def add_category(update: Update, context: CallbackContext) -> int:
+async def add_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    query.answer()
+    await query.answer()
     
     user_id = str(query.from_user.id)
-    users = load_data(USERS_FILE)
-    lang = users[user_id]['lang']
-    
-    if lang == 'uz':
-        text = "Yangi kategoriya nomini yuboring:"
-        back_text = "🔙 Orqaga"
-    else:
-        text = "Отправьте название новой категории:"
-        back_text = "🔙 Назад"
+    lang = user_lang(user_id)
     
-    keyboard = [[InlineKeyboardButton(back_text, callback_data='admin')]]
+    text = texts.get(lang, 'add_category.prompt')
+    keyboard = [[InlineKeyboardButton(texts.get(lang, 'back'), callback_data='admin')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    query.edit_message_text(text=text, reply_markup=reply_markup)
+    await edit_text(query, text, reply_markup)
     
     return ADD_CATEGORY
 
-def save_category(update: Update, context: CallbackContext) -> int:
+async def save_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = str(update.message.from_user.id)
-    users = load_data(USERS_FILE)
-    lang = users[user_id]['lang']
-    products_data = load_data(PRODUCTS_FILE)
+    lang = user_lang(user_id)
     
     category_name = update.message.text
-    category_id = str(len(products_data['categories']) + 1)
-    
-    products_data['categories'][category_id] = category_name
-    save_data(products_data, PRODUCTS_FILE)
+    catalog = store['products'].copy()
+    category = catalog.add_category(category_name)
+    commit_catalog(catalog, [category.id])
     
-    if lang == 'uz':
-        text = f"Yangi kategoriya '{category_name}' qo'shildi!"
-    else:
-        text = f"Новая категория '{category_name}' добавлена!"
-    
-    update.message.reply_text(text)
-    return admin_panel_from_message(update, context)
+    await update.message.reply_text(texts.get(lang, 'add_category.done', name=category_name))
+    return await admin_panel_from_message(update, context)
 
-def add_product(update: Update, context: CallbackContext) -> int:
+async def add_product(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    query.answer()
-    
     user_id = str(query.from_user.id)
-    users = load_data(USERS_FILE)
-    lang = users[user_id]['lang']
-    products_data = load_data(PRODUCTS_FILE)
+    lang = user_lang(user_id)
+    catalog = store['products']
     
-    if not products_data['categories']:
-        if lang == 'uz':
-            text = "Avval kategoriya qo'shishingiz kerak!"
-        else:
-            text = "Сначала нужно добавить категорию!"
-        
-        query.edit_message_text(text=text)
-        return admin_panel(update, context)
+    if not catalog.categories:
+        # The admin panel stays on screen
+        await query.answer(texts.get(lang, 'add_product.no_categories'), show_alert=True)
+        return ADMIN
     
-    if lang == 'uz':
-        text = "Mahsulot qo'shish uchun kategoriyani tanlang:"
-        back_text = "🔙 Orqaga"
-    else:
-        text = "Выберите категорию для добавления товара:"
-        back_text = "🔙 Назад"
+    await query.answer()
+    
+    text = texts.get(lang, 'add_product.choose_category')
+    back_text = texts.get(lang, 'back')
     
     keyboard = []
-    for cat_id, cat_name in products_data['categories'].items():
-        keyboard.append([InlineKeyboardButton(cat_name, callback_data=f'add_prod_{cat_id}')])
+    for cat_id, category in catalog.categories.items():
+        keyboard.append([InlineKeyboardButton(category.name, callback_data=f'add_prod_{cat_id}')])
     keyboard.append([InlineKeyboardButton(back_text, callback_data='admin')])
     
     reply_markup = InlineKeyboardMarkup(keyboard)
-    query.edit_message_text(text=text, reply_markup=reply_markup)
+    await edit_text(query, text, reply_markup)
     
     return ADD_PRODUCT
 
-def get_product_info(update: Update, context: CallbackContext) -> int:
+async def get_product_info(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
-    query.answer()
+    await query.answer()
     
     user_id = str(query.from_user.id)
-    users = load_data(USERS_FILE)
-    lang = users[user_id]['lang']
+    lang = user_lang(user_id)
     
     context.user_data['add_product_category'] = query.data.split('_')[2]
     
-    if lang == 'uz':
-        text = ("Yangi mahsulot haqida ma'lumot yuboring quyidagi formatda:\n\n"
-                "Nomi\nNarxi\nTavsif (ixtiyoriy)\n\n"
-                "Misol: \n"
-                "iPhone 13\n12000000\nEng yangi iPhone modeli")
-        back_text = "🔙 Orqaga"
-    else:
-        text = ("Отправьте информацию о новом товаре в следующем формате:\n\n"
-                "Название\nЦена\nОписание (необязательно)\n\n"
-                "Пример: \n"
-                "iPhone 13\n12000000\nНовейшая модель iPhone")
-        back_text = "🔙 Назад"
-    
-    keyboard = [[InlineKeyboardButton(back_text, callback_data='add_product')]]
+    text = texts.get(lang, 'add_product.prompt')
+    keyboard = [[InlineKeyboardButton(texts.get(lang, 'back'), callback_data='add_product')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
-    query.edit_message_text(text=text, reply_markup=reply_markup)
+    await edit_text(query, text, reply_markup)
     
     return ADD_PRODUCT
 
-def save_product(update: Update, context: CallbackContext) -> int:
+async def save_product(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = str(update.message.from_user.id)
-    users = load_data(USERS_FILE)
-    lang = users[user_id]['lang']
-    products_data = load_data(PRODUCTS_FILE)
+    lang = user_lang(user_id)
     
     category_id = context.user_data['add_product_category']
-    product_info = update.message.text.split('\n')
+    message = update.message
+    product_info = (message.text or message.caption or '').split('\n')
     
-    if len(product_info) < 2:
-        if lang == 'uz':
-            text = "Noto'g'ri format! Iltimos, qayta urinib ko'ring."
-        else:
-            text = "Неверный формат! Пожалуйста, попробуйте еще раз."
-        
-        update.message.reply_text(text)
+    try:
+        product_price = parse_price(product_info[1]) if len(product_info) >= 2 else None
+    except ValueError:
+        product_price = None
+    
+    if product_price is None:
+        await update.message.reply_text(texts.get(lang, 'add_product.bad_format'))
         return ADD_PRODUCT
     
     product_name = product_info[0].strip()
-    product_price = product_info[1].strip()
     product_desc = product_info[2].strip() if len(product_info) > 2 else ""
     
-    if category_id not in products_data['products']:
-        products_data['products'][category_id] = {}
+    image = image_file_id = None
+    if message.photo:
+        # Telegram has already resized the photo and dropped its metadata
+        image_file_id = message.photo[-1].file_id
+    elif message.document:
+        file = await message.document.get_file()
+        try:
+            image = await images.save(message.document.file_unique_id, await file.download_as_bytearray())
+        except ValueError:
+            await message.reply_text(texts.get(lang, 'add_product.bad_image'))
+            return ADD_PRODUCT
+    
+    catalog = store['products'].copy()
+    if catalog.category(category_id) is None:
+        # Deleted while the product was being typed
+        await update.message.reply_text(texts.get(lang, 'manage.gone'))
+        return await admin_panel_from_message(update, context)
+    catalog.add_product(category_id, product_name, product_price, product_desc, image, image_file_id)
+    commit_catalog(catalog, [category_id])
+    
+    await update.message.reply_text(texts.get(lang, 'add_product.done', name=product_name))
+    return await admin_panel_from_message(update, context)
+
+# Import row errors shown to the admin, at most MAX_IMPORT_ERRORS of them
+MAX_IMPORT_ERRORS = 20
+
+async def import_catalog_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = str(query.from_user.id)
+    lang = user_lang(user_id)
+    
+    text = texts.get(lang, 'import.prompt')
+    keyboard = [[InlineKeyboardButton(texts.get(lang, 'back'), callback_data='admin')]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await edit_text(query, text, reply_markup)
+    
+    return IMPORT_CATALOG
+
+async def import_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    if update.message.from_user.id != ADMIN_ID:
+        return ConversationHandler.END
+    
+    user_id = str(update.message.from_user.id)
+    lang = user_lang(user_id)
+    document = update.message.document
+    fmt = detect_format(document.file_name)
+    
+    if fmt is None:
+        await update.message.reply_text(texts.get(lang, 'import.bad_file'))
+        return IMPORT_CATALOG
+    
+    # Download to disk and parse row by row off the event loop
+    file = await document.get_file()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, f'import.{fmt}')
+        await file.download_to_drive(path)
+        rows, errors = await asyncio.to_thread(read_import, path, fmt)
+    
+    # Commit the whole batch at once
+    catalog = store['products'].copy()
+    added, updated = apply_import(catalog, rows)
+    if added or updated:
+        commit_catalog(catalog, {product.category_id for product in added + updated})
+        await store.flush()
+    
+    text = texts.get(lang, 'import.done', added=len(added), updated=len(updated), errors=len(errors))
+    for line_number, code in errors[:MAX_IMPORT_ERRORS]:
+        text += f"\n{line_number}: {texts.get(lang, 'import.error.' + code)}"
+    if len(errors) > MAX_IMPORT_ERRORS:
+        text += "\n..."
+    
+    await update.message.reply_text(text)
+    return await admin_panel_from_message(update, context)
+
+async def export_catalog_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return ConversationHandler.END
+    
+    fmt = query.data.split('_')[1]
+    data = export_catalog(store['products'], fmt)
+    await context.bot.send_document(
+        chat_id=query.message.chat_id,
+        document=data,
+        filename=f"catalog_{datetime.now():%Y%m%d_%H%M}.{fmt}"
+    )
+    
+    return ADMIN
+
+def parse_manage(data):
+    # "manage_p1" -> (None, None), "mc_3_p1" -> ("3", None), "mp_3_7" -> ("3", "7")
+    parts = data.split('_')
+    if parts[0] == 'mc':
+        return parts[1], None
+    if parts[0] == 'mp':
+        return parts[1], parts[2]
+    return None, None
+
+def manage_catalog_screen(lang, page):
+    catalog = store['products']
+    category_ids, page, page_count = paginate(list(catalog.categories), page)
+    
+    text = texts.get(lang, 'manage.title' if category_ids else 'categories.empty')
+    if page_count > 1:
+        text = texts.get(lang, 'page.number', title=text, page=page + 1, page_count=page_count)
+    
+    keyboard = []
+    for category_id in category_ids:
+        keyboard.append([InlineKeyboardButton(catalog.category(category_id).name, callback_data=f'mc_{category_id}')])
+    navigation = page_buttons(lang, page, page_count, 'manage')
+    if navigation:
+        keyboard.append(navigation)
+    keyboard.append([InlineKeyboardButton(texts.get(lang, 'back'), callback_data='admin')])
+    return text, InlineKeyboardMarkup(keyboard)
+
+def manage_category_screen(lang, category_id, page):
+    catalog = store['products']
+    products = catalog.products(category_id)
+    product_ids, page, page_count = paginate(list(products), page)
+    
+    text = texts.get(lang, 'manage.category', name=catalog.category(category_id).name, count=len(products))
+    if page_count > 1:
+        text = texts.get(lang, 'page.number', title=text, page=page + 1, page_count=page_count)
+    
+    keyboard = []
+    for product_id in product_ids:
+        product = products[product_id]
+        name = product.name if product.available else texts.get(lang, 'manage.hidden', name=product.name)
+        keyboard.append([InlineKeyboardButton(name, callback_data=f'mp_{category_id}_{product_id}')])
+    navigation = page_buttons(lang, page, page_count, f'mc_{category_id}')
+    if navigation:
+        keyboard.append(navigation)
+    keyboard += [
+        [InlineKeyboardButton(texts.get(lang, 'manage.rename'), callback_data=f'ec_name_{category_id}')],
+        [
+            InlineKeyboardButton("⬆️", callback_data=f'ec_up_{category_id}'),
+            InlineKeyboardButton("⬇️", callback_data=f'ec_down_{category_id}'),
+            InlineKeyboardButton(texts.get(lang, 'manage.delete'), callback_data=f'ec_del_{category_id}')
+        ],
+        [InlineKeyboardButton(texts.get(lang, 'back'), callback_data='manage')]
+    ]
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def manage_product_screen(lang, category_id, product_id):
+    product = store['products'].product(category_id, product_id)
+    left = await stock.left(category_id, product_id)
+    
+    text = product_text(lang, product) + "\n"
+    text += texts.get(lang, 'manage.stock', count=left) if left is not None else texts.get(lang, 'manage.no_stock')
+    text += "\n" + texts.get(lang, 'manage.shown' if product.available else 'manage.not_shown')
+    
+    key = f'{category_id}_{product_id}'
+    keyboard = [
+        [
+            InlineKeyboardButton(texts.get(lang, 'manage.edit_name'), callback_data=f'ep_name_{key}'),
+            InlineKeyboardButton(texts.get(lang, 'manage.edit_price'), callback_data=f'ep_price_{key}')
+        ],
+        [
+            InlineKeyboardButton(texts.get(lang, 'manage.edit_description'), callback_data=f'ep_desc_{key}'),
+            InlineKeyboardButton(texts.get(lang, 'manage.edit_stock'), callback_data=f'ep_stock_{key}')
+        ],
+        [InlineKeyboardButton(texts.get(lang, 'manage.hide' if product.available else 'manage.show'),
+                              callback_data=f'ep_toggle_{key}')],
+        [
+            InlineKeyboardButton("⬆️", callback_data=f'ep_up_{key}'),
+            InlineKeyboardButton("⬇️", callback_data=f'ep_down_{key}'),
+            InlineKeyboardButton(texts.get(lang, 'manage.delete'), callback_data=f'ep_del_{key}')
+        ],
+        [InlineKeyboardButton(texts.get(lang, 'back'), callback_data=f'mc_{category_id}')]
+    ]
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def manage_screen(lang, category_id=None, product_id=None, page=0):
+    # The deepest of the three screens whose item still exists
+    catalog = store['products']
+    if product_id is not None and catalog.product(category_id, product_id) is not None:
+        return await manage_product_screen(lang, category_id, product_id)
+    if category_id is not None and catalog.category(category_id) is not None:
+        return manage_category_screen(lang, category_id, page)
+    return manage_catalog_screen(lang, page)
+
+async def manage_catalog(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
     
-    product_id = str(len(products_data['products'][category_id]) + 1)
-    products_data['products'][category_id][product_id] = {
-        "name": product_name,
-        "price": product_price,
-        "description": product_desc
-    }
+    if query.from_user.id != ADMIN_ID:
+        return ConversationHandler.END
     
-    save_data(products_data, PRODUCTS_FILE)
+    lang = user_lang(str(query.from_user.id))
+    category_id, product_id = parse_manage(query.data)
+    text, reply_markup = await manage_screen(lang, category_id, product_id, parse_page(query.data))
+    await edit_text(query, text, reply_markup)
     
-    if lang == 'uz':
-        text = f"Yangi mahsulot '{product_name}' qo'shildi!"
+    return MANAGE_CATALOG
+
+async def edit_category(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return ConversationHandler.END
+    
+    lang = user_lang(str(query.from_user.id))
+    _, action, category_id = query.data.split('_')
+    catalog = store['products']
+    category = catalog.category(category_id)
+    
+    if category is None:
+        text, reply_markup = await manage_screen(lang)
+    elif action == 'name':
+        context.user_data['edit'] = [category_id, None, 'name']
+        text = texts.get(lang, 'manage.prompt.name')
+        reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton(texts.get(lang, 'back'),
+                                                                   callback_data=f'mc_{category_id}')]])
+        await edit_text(query, text, reply_markup)
+        return EDIT_VALUE
+    elif action == 'del':
+        text = texts.get(lang, 'manage.confirm_category', name=category.name,
+                         count=len(catalog.products(category_id)))
+        reply_markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton(texts.get(lang, 'manage.confirm'), callback_data=f'ec_rm_{category_id}')],
+            [InlineKeyboardButton(texts.get(lang, 'back'), callback_data=f'mc_{category_id}')]
+        ])
+    elif action == 'rm':
+        catalog = catalog.copy()
+        removed = catalog.remove_category(category_id)
+        commit_catalog(catalog, [category_id])
+        for product in removed:
+            await stock.set(category_id, product.id, None)
+        text, reply_markup = await manage_screen(lang)
+    else:
+        catalog = catalog.copy()
+        catalog.move_category(category_id, -1 if action == 'up' else 1)
+        # Category order is the order of the whole table
+        commit_catalog(catalog, [ALL])
+        text, reply_markup = await manage_screen(lang, category_id)
+    
+    await edit_text(query, text, reply_markup)
+    return MANAGE_CATALOG
+
+async def edit_product(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    await query.answer()
+    
+    if query.from_user.id != ADMIN_ID:
+        return ConversationHandler.END
+    
+    lang = user_lang(str(query.from_user.id))
+    _, action, category_id, product_id = query.data.split('_')
+    catalog = store['products']
+    product = catalog.product(category_id, product_id)
+    
+    if product is None:
+        text, reply_markup = await manage_screen(lang, category_id)
+    elif action in ('name', 'price', 'desc', 'stock'):
+        context.user_data['edit'] = [category_id, product_id, action]
+        text = texts.get(lang, f'manage.prompt.{action}')
+        reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton(
+            texts.get(lang, 'back'), callback_data=f'mp_{category_id}_{product_id}')]])
+        await edit_text(query, text, reply_markup)
+        return EDIT_VALUE
+    elif action == 'del':
+        text = texts.get(lang, 'manage.confirm_product', name=product.name)
+        reply_markup = InlineKeyboardMarkup([
+            [InlineKeyboardButton(texts.get(lang, 'manage.confirm'),
+                                  callback_data=f'ep_rm_{category_id}_{product_id}')],
+            [InlineKeyboardButton(texts.get(lang, 'back'), callback_data=f'mp_{category_id}_{product_id}')]
+        ])
+    elif action == 'rm':
+        catalog = catalog.copy()
+        catalog.remove_product(category_id, product_id)
+        commit_catalog(catalog, [category_id])
+        await stock.set(category_id, product_id, None)
+        text, reply_markup = await manage_screen(lang, category_id)
     else:
-        text = f"Новый товар '{product_name}' добавлен!"
+        catalog = catalog.copy()
+        if action == 'toggle':
+            catalog.update_product(category_id, product_id, available=not product.available)
+        else:
+            catalog.move_product(category_id, product_id, -1 if action == 'up' else 1)
+        commit_catalog(catalog, [category_id])
+        text, reply_markup = await manage_screen(lang, category_id, product_id)
     
-    update.message.reply_text(text)
-    return admin_panel_from_message(update, context)
+    await edit_text(query, text, reply_markup)
+    return MANAGE_CATALOG
 
-def admin_panel_from_message(update: Update, context: CallbackContext) -> int:
-    user_id = str(update.message.from_user.id)
-    users = load_data(USERS_FILE)
-    lang = users[user_id]['lang']
-    
-    if lang == 'uz':
-        text = "👑 Admin paneli:"
-        buttons = [
-            ["📦 Kategoriya qo'shish", "add_category"],
-            ["🛍 Mahsulot qo'shish", "add_product"],
-            ["🔙 Asosiy menyu", "main_menu"]
-        ]
+def parse_stock(text):
+    # A number of units, or "-" to stop tracking the product's stock
+    if text == '-':
+        return None
+    if not text.isdigit():
+        raise ValueError(f'invalid stock: {text!r}')
+    return int(text)
+
+async def save_edit(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    if update.message.from_user.id != ADMIN_ID:
+        return ConversationHandler.END
+    
+    lang = user_lang(str(update.message.from_user.id))
+    category_id, product_id, field = context.user_data.get('edit', (None, None, None))
+    value = update.message.text.strip()
+    catalog = store['products']
+    
+    target = catalog.category(category_id) if product_id is None else catalog.product(category_id, product_id)
+    if target is None:
+        context.user_data.pop('edit', None)
+        await update.message.reply_text(texts.get(lang, 'manage.gone'))
+        text, reply_markup = await manage_screen(lang, category_id)
+        await update.message.reply_text(text=text, reply_markup=reply_markup)
+        return MANAGE_CATALOG
+    
+    try:
+        if field == 'price':
+            changes = {'price': parse_price(value)}
+        elif field == 'stock':
+            quantity = parse_stock(value)
+        elif field == 'desc':
+            changes = {'description': '' if value == '-' else value}
+        else:
+            changes = {'name': value}
+    except ValueError:
+        await update.message.reply_text(texts.get(lang, 'manage.bad_value'))
+        return EDIT_VALUE
+    
+    if field == 'stock':
+        await stock.set(category_id, product_id, quantity)
     else:
-        text = "👑 Админ панель:"
-        buttons = [
-            ["📦 Добавить категорию", "add_category"],
-            ["🛍 Добавить товар", "add_product"],
-            ["🔙 Главное меню", "main_menu"]
-        ]
+        catalog = catalog.copy()
+        if product_id is None:
+            catalog.rename_category(category_id, value)
+        else:
+            catalog.update_product(category_id, product_id, **changes)
+        commit_catalog(catalog, [category_id])
+    context.user_data.pop('edit', None)
+    
+    await update.message.reply_text(texts.get(lang, 'manage.saved'))
+    text, reply_markup = await manage_screen(lang, category_id, product_id)
+    await update.message.reply_text(text=text, reply_markup=reply_markup)
+    return MANAGE_CATALOG
+
+_broadcast_task = None
+
+def forget_sessions(user_ids):
+    # Users removed from the store start over: without a saved conversation, /start reaches start()
+    user_ids = {int(user_id) for user_id in user_ids}
+    for handlers in _application.handlers.values():
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                # Deleting the state makes the application drop it from the persistence too
+                conversations = handler._conversations
+                for key in [key for key in conversations if key[-1] in user_ids]:
+                    del conversations[key]
+    for user_id in user_ids:
+        _application.drop_user_data(user_id)
+
+async def prune_user(user_id):
+    # The user blocked the bot or deleted the account
+    if store['users'].pop(user_id, None) is not None:
+        store.mark_dirty('users', user_id)
+    forget_sessions([user_id])
+    cart = store['carts'].pop(user_id, None)
+    if cart is not None:
+        store.mark_dirty('carts', user_id)
+        for _, line in cart:
+            await stock.put_back(line['category_id'], line['product_id'], line['quantity'])
+
+def new_broadcast(bot):
+    return Broadcast(bot, BROADCAST_FILE, rate=BROADCAST_RATE, on_blocked=prune_user)
+
+async def broadcast_recipients():
+    if SHARD is None:
+        return list(store['users'])
+    # A worker only holds its own users; the database has everyone
+    return await asyncio.to_thread(store.backend.user_ids)
+
+async def run_broadcast(bot, broadcast):
+    stats = await broadcast.run(await broadcast_recipients())
+    text = texts.get(user_lang(str(ADMIN_ID)), 'broadcast.finished', **stats)
+    await bot.send_message(chat_id=ADMIN_ID, text=text)
+
+def start_broadcast(bot, broadcast):
+    global _broadcast_task
+    _broadcast_task = asyncio.create_task(run_broadcast(bot, broadcast))
+
+def broadcast_running():
+    return _broadcast_task is not None and not _broadcast_task.done()
+
+async def broadcast_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    query = update.callback_query
+    user_id = str(query.from_user.id)
+    lang = user_lang(user_id)
     
-    keyboard = [[InlineKeyboardButton(btn[0], callback_data=btn[1])] for btn in buttons]
+    if broadcast_running():
+        await query.answer(texts.get(lang, 'broadcast.running'), show_alert=True)
+        return ADMIN
+    
+    await query.answer()
+    
+    text = texts.get(lang, 'broadcast.prompt', count=len(await broadcast_recipients()))
+    keyboard = [[InlineKeyboardButton(texts.get(lang, 'back'), callback_data='admin')]]
     reply_markup = InlineKeyboardMarkup(keyboard)
+    await edit_text(query, text, reply_markup)
+    
+    return BROADCAST
+
+async def send_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    if update.message.from_user.id != ADMIN_ID:
+        return ConversationHandler.END
+    
+    user_id = str(update.message.from_user.id)
+    lang = user_lang(user_id)
+    
+    if broadcast_running():
+        text = texts.get(lang, 'broadcast.running')
+    else:
+        broadcast = new_broadcast(context.bot)
+        broadcast.create(update.message.text)
+        start_broadcast(context.bot, broadcast)
+        text = texts.get(lang, 'broadcast.started')
     
-    update.message.reply_text(text=text, reply_markup=reply_markup)
+    await update.message.reply_text(text)
+    return await admin_panel_from_message(update, context)
+
+async def admin_panel_from_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    user_id = str(update.message.from_user.id)
+    lang = user_lang(user_id)
+    
+    text, reply_markup = menus.get(build_admin_panel, lang)
+    await update.message.reply_text(text=text, reply_markup=reply_markup)
     
     return ADMIN
 
-def cancel(update: Update, context: CallbackContext) -> int:
-    update.message.reply_text('Amal bekor qilindi.')
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    await update.message.reply_text(texts.get(user_lang(str(update.effective_user.id)), 'cancelled'))
     return ConversationHandler.END
 
-def error(update: Update, context: CallbackContext):
+async def error(update: object, context: ContextTypes.DEFAULT_TYPE):
     logger.warning('Update "%s" caused error "%s"', update, context.error)
 
-def main() -> None:
-    # Bot tokenini o'rnating
-    updater = Updater("8076561745:AAFHdCGcqBQXiST-EXfcWK9uiHUufYm0rA0", use_context=True)
+throttle = Throttle(USER_RATE, USER_BURST)
+
+def callback_key(query):
+    return (query.from_user.id, query.message.message_id if query.message else query.inline_message_id, query.data)
+
+def touch_user(user_id):
+    # Only rewritten once the saved time is LAST_SEEN_RESOLUTION old, so most updates cost no write
+    user = store['users'].get(user_id)
+    if user is None:
+        return
+    now = int(time.time())
+    if now - user.get('last_seen', 0) >= LAST_SEEN_RESOLUTION:
+        user['last_seen'] = now
+        store.mark_dirty('users', user_id)
+
+async def guard(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    # Runs before the conversation; drops spam without touching the store
+    user = update.effective_user
+    query = update.callback_query
+    if user is None or not (query or update.message):
+        return
+    if not throttle.allow(user.id):
+        reason = 'rate_limited'
+    elif query and not throttle.begin(callback_key(query)):
+        reason = 'duplicate_callback'
+    else:
+        analytics.visit(str(user.id))
+        touch_user(str(user.id))
+        return
+    metrics.count_dropped(reason)
+    if query:
+        await query.answer()
+    raise ApplicationHandlerStop
+
+async def release(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.callback_query:
+        throttle.end(callback_key(update.callback_query))
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_user.id != ADMIN_ID:
+        return
+    await update.message.reply_text(metrics.report())
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records the duration of every Bot API call."""
+    
+    async def do_request(self, url, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().do_request(url, *args, **kwargs)
+        finally:
+            metrics.observe_api(url.rsplit('/', 1)[-1], time.perf_counter() - start)
+
+def create_order_log():
+    if SHARD is None:
+        return OrderLog(ORDERS_FILE)
+    # One log per worker, with ids interleaved so they stay unique
+    index, count = SHARD
+    name, ext = os.path.splitext(ORDERS_FILE)
+    return OrderLog(f'{name}.{index}{ext}', first_id=index + 1, id_step=count)
+
+def create_maintenance():
+    archive = ARCHIVE_FILE
+    if SHARD is not None:
+        # Each worker archives the users it owns
+        name, ext = archive.split('.', 1)
+        archive = f'{name}.{SHARD[0]}.{ext}'
+    return Maintenance(store, stock, archive_path=archive, user_retention=USER_RETENTION_DAYS * DAY,
+                       cart_retention=CART_RETENTION_DAYS * DAY, interval=MAINTENANCE_INTERVAL,
+                       keep=(str(ADMIN_ID),), on_archived=forget_sessions)
+
+order_log = None
+maintenance = None
+_order_notifier = None
+_metrics_server = None
+_application = None
+_catalog_watcher = None
+_catalog_loader = None
+
+def init() -> None:
+    # Everything that reads or creates files; nothing is touched by merely importing this module
+    global store, stock, order_log, analytics, texts, maintenance
+    store = create_store()
+    stock = create_stock()
+    order_log = create_order_log()
+    maintenance = create_maintenance()
+    analytics = create_analytics()
+    texts = Translations.load()
+    mark_startup('init')
+
+# Log how long each startup phase took, set by --profile-startup
+PROFILE_STARTUP = False
+_startup_marks = []
+
+def mark_startup(phase):
+    _startup_marks.append((phase, time.perf_counter()))
+
+def log_startup_profile():
+    if not PROFILE_STARTUP:
+        return
+    phases = []
+    previous = _import_started
+    for phase, at in _startup_marks:
+        phases.append(f'{phase} {at - previous:.3f} s')
+        previous = at
+    logger.info('Startup: %s; ready %.3f s after the import started', ', '.join(phases), previous - _import_started)
+
+async def watch_catalog():
+    version = await asyncio.to_thread(store.backend.catalog_version)
+    while True:
+        await asyncio.sleep(CATALOG_POLL_INTERVAL)
+        latest = await asyncio.to_thread(store.backend.catalog_version)
+        if latest != version:
+            version = latest
+            await store.reload('products')
+            catalog_changed()
+
+async def on_startup(application: Application) -> None:
+    mark_startup('application')
+    global _application
+    _application = application
+    await store.load()
+    store.start()
+    # Updates are answered while the catalog is still being read
+    global _catalog_loader
+    _catalog_loader = asyncio.create_task(store.preload())
+    mark_startup('store')
+    
+    # Orders the admin was not told about before the last shutdown are sent again
+    global _order_notifier
+    await asyncio.to_thread(order_log.load)
+    _order_notifier = OrderNotifier(application.bot, ADMIN_ID, order_log, admin_order_text,
+                                    batch_window=ORDER_BATCH_WINDOW)
+    _order_notifier.start(order_log.pending())
+    mark_startup('orders')
+    
+    await asyncio.to_thread(analytics.load)
+    analytics.start()
+    maintenance.start()
+    mark_startup('analytics')
+    
+    global _metrics_server
+    if METRICS_PORT:
+        _metrics_server = await serve_metrics('0.0.0.0', METRICS_PORT)
+    
+    if not owns_user(ADMIN_ID):
+        # Catalog edits are made by the admin's worker
+        global _catalog_watcher
+        _catalog_watcher = asyncio.create_task(watch_catalog())
+    else:
+        # Pick up a broadcast interrupted by the last shutdown
+        broadcast = new_broadcast(application.bot)
+        if broadcast.resume():
+            logger.info('Resuming interrupted broadcast')
+            start_broadcast(application.bot, broadcast)
     
-    dp = updater.dispatcher
+    log_startup_profile()
+
+async def on_shutdown(application: Application) -> None:
+    if _metrics_server is not None:
+        _metrics_server.close()
+    if _catalog_watcher is not None:
+        _catalog_watcher.cancel()
+    if _catalog_loader is not None:
+        _catalog_loader.cancel()
+    if broadcast_running():
+        # The checkpoint lets the next start continue where this one stopped
+        _broadcast_task.cancel()
+        try:
+            await _broadcast_task
+        except asyncio.CancelledError:
+            pass
+    if _order_notifier is not None:
+        await _order_notifier.stop()
+    await analytics.stop()
+    await maintenance.stop()
+    images.shutdown()
+    await store.stop()
+
+def build_application(bot: Optional[ExtBot] = None) -> Application:
+    builder = Application.builder()
+    if bot is None:
+        builder = (
+            builder
+            .token(BOT_TOKEN)
+            .base_url(BOT_API_URL)
+            .request(InstrumentedRequest(connection_pool_size=256))
+            .get_updates_request(InstrumentedRequest())
+        )
+    else:
+        # A preconfigured bot, e.g. the fake one used by the benchmarks
+        builder = builder.bot(bot)
+    application = (
+        builder
+        .concurrent_updates(True)
+        .persistence(StorePersistence(create_backend(SESSION_FILES), flush_interval=FLUSH_INTERVAL,
+                                      update_interval=FLUSH_INTERVAL))
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
     
     conv_handler = ConversationHandler(
-        entry_points=[CommandHandler('start', start)],
+        entry_points=[
+            CommandHandler('start', start),
+            CommandHandler('search', search)
+        ],
         states={
             SELECT_LANG: [
                 CallbackQueryHandler(select_lang, pattern='^lang_'),
@@ -606,17 +1659,27 @@ def main() -> None:
             ],
             CATEGORIES: [
                 CallbackQueryHandler(show_products, pattern='^cat_'),
+                CallbackQueryHandler(show_categories, pattern=r'^products_p\d+$'),
                 CallbackQueryHandler(main_menu, pattern='^main_menu$')
             ],
             PRODUCTS: [
                 CallbackQueryHandler(product_detail, pattern='^prod_'),
+                CallbackQueryHandler(main_menu, pattern='^main_menu$'),
+                CallbackQueryHandler(show_products, pattern='^cat_'),
                 CallbackQueryHandler(show_categories, pattern='^products$'),
                 CallbackQueryHandler(add_to_cart, pattern='^add_')
             ],
             CART: [
                 CallbackQueryHandler(clear_cart, pattern='^clear_cart$'),
+                CallbackQueryHandler(change_cart_item, pattern='^(inc|dec|rm)_'),
                 CallbackQueryHandler(main_menu, pattern='^main_menu$'),
-                CallbackQueryHandler(show_cart, pattern='^order$')
+                CallbackQueryHandler(checkout, pattern='^order$')
+            ],
+            CHECKOUT_PHONE: [
+                MessageHandler(filters.CONTACT | (filters.TEXT & ~filters.COMMAND), checkout_phone)
+            ],
+            CHECKOUT_ADDRESS: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, checkout_address)
             ],
             ABOUT: [
                 CallbackQueryHandler(main_menu, pattern='^main_menu$')
@@ -624,26 +1687,237 @@ def main() -> None:
             ADMIN: [
                 CallbackQueryHandler(add_category, pattern='^add_category$'),
                 CallbackQueryHandler(add_product, pattern='^add_product$'),
+                CallbackQueryHandler(import_catalog_prompt, pattern='^import_catalog$'),
+                CallbackQueryHandler(export_catalog_file, pattern='^export_(csv|jsonl)$'),
+                CallbackQueryHandler(broadcast_prompt, pattern='^broadcast$'),
+                CallbackQueryHandler(show_analytics, pattern='^analytics$'),
+                CallbackQueryHandler(manage_catalog, pattern='^manage$'),
                 CallbackQueryHandler(main_menu, pattern='^main_menu$')
             ],
+            MANAGE_CATALOG: [
+                CallbackQueryHandler(manage_catalog, pattern='^(manage|mc_|mp_)'),
+                CallbackQueryHandler(edit_category, pattern='^ec_'),
+                CallbackQueryHandler(edit_product, pattern='^ep_'),
+                CallbackQueryHandler(admin_panel, pattern='^admin$')
+            ],
+            EDIT_VALUE: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, save_edit),
+                CallbackQueryHandler(manage_catalog, pattern='^(mc_|mp_)')
+            ],
             ADD_CATEGORY: [
-                MessageHandler(Filters.text & ~Filters.command, save_category),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, save_category),
                 CallbackQueryHandler(admin_panel, pattern='^admin$')
             ],
             ADD_PRODUCT: [
                 CallbackQueryHandler(get_product_info, pattern='^add_prod_'),
-                MessageHandler(Filters.text & ~Filters.command, save_product),
+                MessageHandler((filters.TEXT & ~filters.COMMAND) | filters.PHOTO | filters.Document.IMAGE,
+                               save_product),
+                CallbackQueryHandler(admin_panel, pattern='^admin$')
+            ],
+            IMPORT_CATALOG: [
+                MessageHandler(filters.Document.ALL, import_catalog),
+                CallbackQueryHandler(admin_panel, pattern='^admin$')
+            ],
+            BROADCAST: [
+                MessageHandler(filters.TEXT & ~filters.COMMAND, send_broadcast),
                 CallbackQueryHandler(admin_panel, pattern='^admin$')
             ]
         },
-        fallbacks=[CommandHandler('cancel', cancel)]
+        fallbacks=[
+            CommandHandler('cancel', cancel),
+            CommandHandler('search', search)
+        ],
+        name='shop',
+        persistent=True
     )
     
-    dp.add_handler(conv_handler)
-    dp.add_error_handler(error)
+    # Merge each handler's message edits, and record its latency and Bot API calls
+    conversation_handlers = conv_handler.entry_points + conv_handler.fallbacks
+    for state_handlers in conv_handler.states.values():
+        conversation_handlers += state_handlers
+    for handler in conversation_handlers:
+        handler.callback = timed(outbox.collect(handler.callback))
+    
+    application.add_handler(TypeHandler(Update, guard), group=-1)
+    application.add_handler(conv_handler)
+    application.add_handler(InlineQueryHandler(timed(inline_search)))
+    application.add_handler(CommandHandler('stats', stats))
+    application.add_handler(TypeHandler(Update, release), group=1)
+    application.add_error_handler(error)
+    
+    return application
+
+async def run_webhook(application: Application, args: argparse.Namespace) -> None:
+    async def handle_updates(updates):
+        for data in updates:
+            await application.update_queue.put(Update.de_json(data, application.bot))
+    
+    server = WebhookServer(
+        handle_updates,
+        host=args.host,
+        port=args.port,
+        path=args.path,
+        secret_token=args.secret_token
+    )
     
-    updater.start_polling()
-    updater.idle()
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    
+    await application.initialize()
+    await on_startup(application)
+    await application.start()
+    if args.webhook_url:
+        await application.bot.set_webhook(
+            url=args.webhook_url,
+            secret_token=args.secret_token,
+            allowed_updates=Update.ALL_TYPES
+        )
+    await server.start()
+    
+    try:
+        await stop_event.wait()
+    finally:
+        await server.stop()
+        await application.stop()
+        await on_shutdown(application)
+        await application.shutdown()
+
+async def serve_shard(application: Application, queue) -> None:
+    await application.initialize()
+    await on_startup(application)
+    await application.start()
+    
+    async def process(data):
+        await application.process_update(Update.de_json(data, application.bot))
+    
+    try:
+        await consume(queue, process)
+    finally:
+        await application.stop()
+        await on_shutdown(application)
+        await application.shutdown()
+
+def configure_shard(index: int, count: int, metrics_port: int = 0) -> None:
+    global SHARD, METRICS_PORT
+    SHARD = (index, count)
+    METRICS_PORT = metrics_port + index if metrics_port else 0
+    init()
+
+def run_worker(index: int, count: int, queue, metrics_port: int, profile_startup: bool = False) -> None:
+    global PROFILE_STARTUP
+    # The ingress process decides when to stop and tells the workers through their queues
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    PROFILE_STARTUP = profile_startup
+    mark_startup('import')
+    configure_shard(index, count, metrics_port)
+    asyncio.run(serve_shard(build_application(), queue))
+
+async def run_ingress(args: argparse.Namespace, router: ShardRouter) -> None:
+    async def handle_updates(updates):
+        router.dispatch(updates)
+    
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    
+    bot = ExtBot(BOT_TOKEN, base_url=BOT_API_URL, request=InstrumentedRequest(),
+                 get_updates_request=InstrumentedRequest())
+    async with bot:
+        if args.mode == 'webhook':
+            server = WebhookServer(
+                handle_updates,
+                host=args.host,
+                port=args.port,
+                path=args.path,
+                secret_token=args.secret_token
+            )
+            if args.webhook_url:
+                await bot.set_webhook(
+                    url=args.webhook_url,
+                    secret_token=args.secret_token,
+                    allowed_updates=Update.ALL_TYPES
+                )
+            await server.start()
+            try:
+                await stop_event.wait()
+            finally:
+                await server.stop()
+        else:
+            await bot.delete_webhook()
+            poller = asyncio.create_task(poll_updates(bot, handle_updates))
+            try:
+                await stop_event.wait()
+            finally:
+                poller.cancel()
+                try:
+                    await poller
+                except asyncio.CancelledError:
+                    pass
+
+def run_sharded(args: argparse.Namespace) -> None:
+    # Fresh interpreters, so no worker inherits open files or database connections
+    context = multiprocessing.get_context('spawn')
+    # Create and migrate the database here, before any worker opens it
+    SqliteBackend(SQLITE_PATH).close()
+    queues = [context.Queue() for _ in range(args.workers)]
+    workers = [
+        context.Process(target=run_worker,
+                        args=(index, args.workers, queue, args.metrics_port, args.profile_startup),
+                        name=f'worker-{index}')
+        for index, queue in enumerate(queues)
+    ]
+    for worker in workers:
+        worker.start()
+    
+    router = ShardRouter(queues)
+    try:
+        asyncio.run(run_ingress(args, router))
+    finally:
+        router.close()
+        for worker in workers:
+            worker.join()
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Telegram shop bot')
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default=os.getenv('BOT_MODE', 'polling'))
+    parser.add_argument('--host', default=os.getenv('WEBHOOK_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('WEBHOOK_PORT', '8443')))
+    parser.add_argument('--path', default=os.getenv('WEBHOOK_PATH', '/webhook'))
+    parser.add_argument('--secret-token', default=os.getenv('WEBHOOK_SECRET'))
+    parser.add_argument('--webhook-url', default=os.getenv('WEBHOOK_URL'),
+                        help='public URL to register with Telegram; leave unset to skip setWebhook')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help='serve Prometheus metrics on this port')
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help='worker processes to shard users across (needs the sqlite backend); '
+                             'worker N serves metrics on --metrics-port + N')
+    parser.add_argument('--profile-startup', action='store_true',
+                        help='log how long the import, init() and each startup step took')
+    args = parser.parse_args()
+    if args.workers and STORAGE_BACKEND != 'sqlite':
+        parser.error('--workers needs STORAGE_BACKEND=sqlite')
+    return args
+
+def main() -> None:
+    global METRICS_PORT, PROFILE_STARTUP
+    mark_startup('import')
+    args = parse_args()
+    METRICS_PORT = args.metrics_port
+    PROFILE_STARTUP = args.profile_startup
+    if args.workers:
+        run_sharded(args)
+        return
+    init()
+    application = build_application()
+    
+    if args.mode == 'webhook':
+        asyncio.run(run_webhook(application, args))
+    else:
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import timedelta
+
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second to different chats
+DEFAULT_RATE = 25
+
+
+class RateLimiter:
+    """Spaces calls evenly at ``rate`` per second, shared by all senders."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            if self._next > now:
+                await asyncio.sleep(self._next - now)
+                now = self._next
+            self._next = now + self.interval
+
+    def pause(self, seconds):
+        """Hold every sender back for ``seconds`` (after a RetryAfter)."""
+        self._next = max(self._next, asyncio.get_running_loop().time() + seconds)
+
+
+def retry_seconds(error):
+    value = error.retry_after
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+class Broadcast:
+    """Sends one text message to many users with a resumable checkpoint.
+
+    The checkpoint is a JSONL file: a header line with the message text,
+    followed by one line per finished user. Users already in the file are
+    skipped when the broadcast is resumed, so an interrupted run does not
+    message anyone twice. Users who blocked the bot are passed to
+    the coroutine function ``on_blocked`` so the caller can prune them.
+    """
+
+    def __init__(self, bot, checkpoint_path, rate=DEFAULT_RATE, concurrency=10, on_blocked=None):
+        self.bot = bot
+        self.checkpoint_path = checkpoint_path
+        self.limiter = RateLimiter(rate)
+        self.concurrency = concurrency
+        self.on_blocked = on_blocked
+        self.text = None
+        self.stats = {'sent': 0, 'blocked': 0, 'failed': 0, 'skipped': 0}
+        self._done = set()
+        self._checkpoint = None
+
+    def create(self, text):
+        self.text = text
+        with open(self.checkpoint_path, 'w') as f:
+            f.write(json.dumps({"text": text}, ensure_ascii=False) + '\n')
+
+    def resume(self):
+        """Load an unfinished broadcast; returns False if there is none."""
+        if not os.path.exists(self.checkpoint_path):
+            return False
+        with open(self.checkpoint_path, 'r') as f:
+            header = f.readline()
+            if not header.strip():
+                return False
+            self.text = json.loads(header)['text']
+            for line in f:
+                try:
+                    self._done.add(json.loads(line)['user_id'])
+                except (ValueError, KeyError):
+                    # A line cut short by a crash
+                    continue
+        return True
+
+    def _record(self, user_id, result):
+        self.stats[result] += 1
+        self._checkpoint.write(json.dumps({"user_id": user_id, "result": result}) + '\n')
+        self._checkpoint.flush()
+
+    async def _finish(self, user_id, result):
+        self._record(user_id, result)
+        if result == 'blocked' and self.on_blocked is not None:
+            await self.on_blocked(user_id)
+
+    async def _deliver(self, user_id):
+        """Send the message once; None means try again after a RetryAfter."""
+        try:
+            await self.bot.send_message(chat_id=int(user_id), text=self.text)
+            return 'sent'
+        except RetryAfter as e:
+            logger.info('Broadcast throttled for %s seconds', e.retry_after)
+            self.limiter.pause(retry_seconds(e))
+            return None
+        except Forbidden:
+            return 'blocked'
+        except BadRequest as e:
+            return 'blocked' if 'chat not found' in str(e).lower() else 'failed'
+        except TelegramError as e:
+            logger.warning('Broadcast to %s failed: %s', user_id, e)
+            return 'failed'
+
+    async def _send(self, user_id):
+        result = None
+        while result is None:
+            await self.limiter.acquire()
+            delivery = asyncio.ensure_future(self._deliver(user_id))
+            try:
+                result = await asyncio.shield(delivery)
+            except asyncio.CancelledError:
+                # The request may already have reached Telegram; wait for the answer and
+                # record it, so resuming does not message this user again
+                result = await delivery
+                if result is not None:
+                    await self._finish(user_id, result)
+                raise
+        await self._finish(user_id, result)
+
+    async def run(self, user_ids):
+        """Send to every id in ``user_ids`` not already in the checkpoint."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+
+        def finished(task):
+            tasks.discard(task)
+            semaphore.release()
+
+        with open(self.checkpoint_path, 'a') as self._checkpoint:
+            try:
+                for user_id in user_ids:
+                    if user_id in self._done:
+                        self.stats['skipped'] += 1
+                        continue
+                    await semaphore.acquire()
+                    task = asyncio.create_task(self._send(user_id))
+                    tasks.add(task)
+                    task.add_done_callback(finished)
+                if tasks:
+                    await asyncio.gather(*tasks)
+            except asyncio.CancelledError:
+                # Stop the senders while the checkpoint is still open for their last lines
+                pending = list(tasks)
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+                raise
+
+        os.remove(self.checkpoint_path)
+        return self.stats
@@ -0,0 +1,107 @@
+from catalog import TIYIN_PER_SOM
+
+
+def line_key(category_id, product_id):
+    return f'{category_id}_{product_id}'
+
+
+def legacy_price(value):
+    # Carts saved before prices were typed hold so'm, e.g. "12000" or 12000
+    try:
+        return int(str(value).replace(' ', '')) * TIYIN_PER_SOM
+    except ValueError:
+        return 0
+
+
+class Cart:
+    """A user's cart with one line per (category_id, product_id).
+
+    Adding a product that is already in the cart increases its quantity,
+    and the cart keeps a running total so rendering it is proportional to
+    the number of distinct products, not to the number of taps.
+    """
+
+    __slots__ = ('lines', 'total')
+
+    def __init__(self):
+        # line key -> {"category_id", "product_id", "name", "price", "quantity"}
+        self.lines = {}
+        self.total = 0
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __iter__(self):
+        return iter(self.lines.items())
+
+    def add(self, category_id, product_id, name, price, quantity=1):
+        """Add ``quantity`` of a product; ``price`` is in tiyin."""
+        key = line_key(category_id, product_id)
+        line = self.lines.get(key)
+        if line is None:
+            line = self.lines[key] = {
+                "category_id": category_id,
+                "product_id": product_id,
+                "name": name,
+                "price": price,
+                "quantity": 0
+            }
+        line['quantity'] += quantity
+        self.total += line['price'] * quantity
+        return key
+
+    def change(self, key, delta):
+        """Change a line's quantity by ``delta``; a line that drops to zero is removed."""
+        line = self.lines.get(key)
+        if line is None:
+            return 0
+        if line['quantity'] + delta <= 0:
+            self.remove(key)
+            return 0
+        line['quantity'] += delta
+        self.total += line['price'] * delta
+        return line['quantity']
+
+    def reprice(self, key, price):
+        """Change a line's unit price (in tiyin)."""
+        line = self.lines[key]
+        self.total += (price - line['price']) * line['quantity']
+        line['price'] = price
+
+    def remove(self, key):
+        line = self.lines.pop(key, None)
+        if line is not None:
+            self.total -= line['price'] * line['quantity']
+
+    def clear(self):
+        self.lines.clear()
+        self.total = 0
+
+    def to_dict(self):
+        return {
+            key: {"name": line['name'], "unit_price": line['price'], "quantity": line['quantity']}
+            for key, line in self.lines.items()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a cart from its stored form.
+
+        Also accepts the old formats priced in so'm: the list of items,
+        whose repeated products are merged, and lines with a ``price``.
+        """
+        cart = cls()
+        if isinstance(data, list):
+            for item in data:
+                cart.add(item['category_id'], item['product_id'], item['name'],
+                         legacy_price(item['price']), item['quantity'])
+        else:
+            for key, line in data.items():
+                category_id, product_id = key.split('_', 1)
+                price = line['unit_price'] if 'unit_price' in line else legacy_price(line['price'])
+                cart.add(category_id, product_id, line['name'], price, line['quantity'])
+        return cart
+
+
+def decode_carts(document):
+    return {user_id: Cart.from_dict(data) for user_id, data in document.items()}
@@ -0,0 +1,244 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Buttons per page in category and product listings
+PAGE_SIZE = 8
+
+# Prices are kept as integers in tiyin, the 1/100 fraction of a so'm
+TIYIN_PER_SOM = 100
+
+
+def parse_price(text):
+    """Parse a so'm amount such as "12000", "12 000" or "12000.50" into tiyin.
+
+    Raises ValueError unless the amount is positive with at most two decimals.
+    """
+    value = str(text).replace(' ', '').replace(',', '.').strip()
+    som, _, fraction = value.partition('.')
+    if not som.isdigit() or (fraction and not (fraction.isdigit() and len(fraction) <= 2)):
+        raise ValueError(f'invalid price: {text!r}')
+    price = int(som) * TIYIN_PER_SOM + int(fraction.ljust(2, '0') or 0)
+    if price <= 0:
+        raise ValueError(f'invalid price: {text!r}')
+    return price
+
+
+def format_price(price):
+    som, tiyin = divmod(price, TIYIN_PER_SOM)
+    return f"{som}.{tiyin:02d}" if tiyin else str(som)
+
+
+class Category:
+    __slots__ = ('id', 'name')
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class Product:
+    __slots__ = ('id', 'category_id', 'name', 'price', 'description', 'image', 'image_file_id', 'available')
+
+    def __init__(self, id, category_id, name, price, description='', image=None, image_file_id=None,
+                 available=True):
+        self.id = id
+        self.category_id = category_id
+        self.name = name
+        # Integer tiyin
+        self.price = price
+        self.description = description
+        # Photo to upload (a local path), and Telegram's file_id for it once uploaded
+        self.image = image
+        self.image_file_id = image_file_id
+        # Hidden products stay in the catalog but are not shown to shoppers
+        self.available = available
+
+    def replace(self, **changes):
+        """A copy of this product with ``changes`` applied."""
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return Product(**fields)
+
+    def to_dict(self):
+        data = {"name": self.name, "price": self.price, "description": self.description}
+        if self.image or self.image_file_id:
+            data['image'] = self.image
+            data['image_file_id'] = self.image_file_id
+        if not self.available:
+            data['available'] = False
+        return data
+
+
+class Catalog:
+    """Categories and products, with prices already parsed to tiyin.
+
+    ``products_by_category`` maps a category id to its products in
+    display order. Ids are handed out from counters that only grow and
+    are saved with the catalog, so an id is never reused after a delete.
+
+    A catalog that shoppers are reading is never changed in place: edits
+    are made on ``copy()``, which shares the product dicts of the
+    categories it does not touch, and the copy then replaces the
+    original. Products are replaced rather than modified for the same
+    reason.
+    """
+
+    def __init__(self):
+        self.categories = {}            # category id -> Category
+        self.products_by_category = {}  # category id -> {product id -> Product}
+        self.next_category_id = 1
+        self.next_product_id = 1
+        # Categories whose product dict is still shared with the catalog this was copied from
+        self._shared = set()
+
+    def category(self, category_id):
+        return self.categories.get(category_id)
+
+    def products(self, category_id):
+        return self.products_by_category.get(category_id, {})
+
+    def product(self, category_id, product_id):
+        return self.products(category_id).get(product_id)
+
+    def all_products(self):
+        for products in self.products_by_category.values():
+            yield from products.values()
+
+    def copy(self):
+        catalog = Catalog()
+        catalog.categories = dict(self.categories)
+        catalog.products_by_category = dict(self.products_by_category)
+        catalog.next_category_id = self.next_category_id
+        catalog.next_product_id = self.next_product_id
+        catalog._shared = set(self.products_by_category)
+        return catalog
+
+    def _writable(self, category_id):
+        # Copy a category's products the first time this catalog changes them
+        products = self.products_by_category.get(category_id, {})
+        if category_id in self._shared or category_id not in self.products_by_category:
+            products = self.products_by_category[category_id] = dict(products)
+            self._shared.discard(category_id)
+        return products
+
+    def add_category(self, name):
+        category = Category(str(self.next_category_id), name)
+        self.next_category_id += 1
+        self.categories[category.id] = category
+        self.products_by_category.setdefault(category.id, {})
+        return category
+
+    def rename_category(self, category_id, name):
+        self.categories[category_id] = Category(category_id, name)
+
+    def remove_category(self, category_id):
+        """Remove a category with its products and return the removed products."""
+        del self.categories[category_id]
+        self._shared.discard(category_id)
+        return list(self.products_by_category.pop(category_id, {}).values())
+
+    def move_category(self, category_id, offset):
+        """Move a category ``offset`` places up (negative) or down the listing."""
+        self.categories = _moved(self.categories, category_id, offset)
+
+    def add_product(self, category_id, name, price, description='', image=None, image_file_id=None):
+        product = Product(str(self.next_product_id), category_id, name, price, description, image, image_file_id)
+        self.next_product_id += 1
+        self._writable(category_id)[product.id] = product
+        return product
+
+    def update_product(self, category_id, product_id, **changes):
+        products = self._writable(category_id)
+        product = products[product_id] = products[product_id].replace(**changes)
+        return product
+
+    def remove_product(self, category_id, product_id):
+        return self._writable(category_id).pop(product_id)
+
+    def move_product(self, category_id, product_id, offset):
+        self.products_by_category[category_id] = _moved(self._writable(category_id), product_id, offset)
+
+    def to_dict(self):
+        return {
+            "categories": {category_id: category.name for category_id, category in self.categories.items()},
+            "products": {
+                category_id: {product_id: product.to_dict() for product_id, product in products.items()}
+                for category_id, products in self.products_by_category.items()
+            },
+            "next_category_id": self.next_category_id,
+            "next_product_id": self.next_product_id
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a catalog from its stored form.
+
+        Prices saved before they were typed are so'm strings; they are
+        converted to tiyin here, once.
+        """
+        catalog = cls()
+        for category_id, name in data.get('categories', {}).items():
+            catalog.categories[category_id] = Category(category_id, name)
+            catalog.products_by_category[category_id] = {}
+        for category_id, products in data.get('products', {}).items():
+            items = catalog.products_by_category.setdefault(category_id, {})
+            for product_id, product in products.items():
+                price = product['price']
+                if not isinstance(price, int):
+                    try:
+                        price = parse_price(price)
+                    except ValueError:
+                        logger.warning('Product %s/%s has an invalid price %r', category_id, product_id, price)
+                        price = 0
+                items[product_id] = Product(
+                    product_id, category_id, product['name'], price, product.get('description', ''),
+                    product.get('image'), product.get('image_file_id'), product.get('available', True))
+        catalog.next_category_id = max(data.get('next_category_id', 1), _next_id(catalog.categories))
+        catalog.next_product_id = max(
+            data.get('next_product_id', 1),
+            max((_next_id(products) for products in catalog.products_by_category.values()), default=1))
+        return catalog
+
+
+def _moved(items, key, offset):
+    # A new dict with ``key`` moved ``offset`` places, clamped to the ends
+    keys = list(items)
+    index = keys.index(key)
+    keys.insert(min(max(index + offset, 0), len(keys) - 1), keys.pop(index))
+    return {k: items[k] for k in keys}
+
+
+def _next_id(ids):
+    return max((int(i) for i in ids if str(i).isdigit()), default=0) + 1
+
+
+def decode_catalog(document):
+    return Catalog.from_dict(document)
+
+
+class CatalogIndex:
+    """Ordered id lists for the paginated category and product listings.
+
+    Built once per catalog version so that rendering a page only slices
+    the list and looks up the items shown on that page. Hidden products
+    are left out.
+    """
+
+    def __init__(self, catalog):
+        self.category_ids = list(catalog.categories)
+        self.products_by_category = {
+            category_id: [product_id for product_id, product in products.items() if product.available]
+            for category_id, products in catalog.products_by_category.items()
+        }
+
+    def products(self, category_id):
+        return self.products_by_category.get(category_id, [])
+
+
+def paginate(ids, page, page_size=PAGE_SIZE):
+    """Return ``(page_ids, page, page_count)`` with ``page`` clamped to range."""
+    page_count = max(1, -(-len(ids) // page_size))
+    page = min(max(page, 0), page_count - 1)
+    start = page * page_size
+    return ids[start:start + page_size], page, page_count
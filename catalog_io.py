@@ -0,0 +1,139 @@
+import csv
+import io
+import json
+import os
+
+from catalog import format_price, parse_price as parse_tiyin
+
+# Columns of an import/export file; id and description are optional on import
+COLUMNS = ('id', 'category', 'name', 'price', 'description')
+
+FORMATS = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.ndjson': 'jsonl',
+}
+
+
+def detect_format(filename):
+    return FORMATS.get(os.path.splitext(filename or '')[1].lower())
+
+
+def iter_rows(path, fmt):
+    """Yield ``(line_number, row)`` pairs from a CSV or JSONL file one at a time."""
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if fmt == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield line_number, row
+
+
+class RowError(ValueError):
+    """A rejected import row.
+
+    ``code`` is one of 'bad_row', 'no_category', 'no_name' or 'bad_price'.
+    """
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+
+def parse_price(value):
+    try:
+        return parse_tiyin(value)
+    except ValueError:
+        raise RowError('bad_price') from None
+
+
+def validate_row(row):
+    if not isinstance(row, dict):
+        raise RowError('bad_row')
+    category = str(row.get('category') or '').strip()
+    name = str(row.get('name') or '').strip()
+    if not category:
+        raise RowError('no_category')
+    if not name:
+        raise RowError('no_name')
+    return {
+        "id": str(row.get('id') or '').strip() or None,
+        "category": category,
+        "name": name,
+        "price": parse_price(row.get('price', '')),
+        "description": str(row.get('description') or '').strip()
+    }
+
+
+def read_import(path, fmt):
+    """Parse and validate an import file.
+
+    Returns ``(rows, errors)`` where ``errors`` is a list of
+    ``(line_number, error_code)`` pairs for the rejected rows.
+    """
+    rows, errors = [], []
+    for line_number, row in iter_rows(path, fmt):
+        try:
+            rows.append(validate_row(row))
+        except RowError as e:
+            errors.append((line_number, e.code))
+    return rows, errors
+
+
+def apply_import(catalog, rows):
+    """Apply validated rows to the catalog.
+
+    A row whose ``id`` ("<category id>_<product id>", as exported) names
+    an existing product updates its name, price and description; it
+    stays in its category. Other rows
+    are added as new products, creating categories by name. Returns
+    ``(added, updated)`` lists of Products; unchanged rows are in neither.
+    """
+    by_name = {category.name.casefold(): category.id for category in catalog.categories.values()}
+    added, updated = [], []
+    for row in rows:
+        product = catalog.product(*row['id'].split('_', 1)) if row['id'] and '_' in row['id'] else None
+        if product is not None:
+            changes = {field: row[field] for field in ('name', 'price', 'description')
+                       if getattr(product, field) != row[field]}
+            if changes:
+                updated.append(catalog.update_product(product.category_id, product.id, **changes))
+            continue
+        category_id = by_name.get(row['category'].casefold())
+        if category_id is None:
+            category_id = catalog.add_category(row['category']).id
+            by_name[row['category'].casefold()] = category_id
+        added.append(catalog.add_product(category_id, row['name'], row['price'], row['description']))
+    return added, updated
+
+
+def export_catalog(catalog, fmt):
+    """Serialize the catalog in the same format accepted by the importer.
+
+    Rows carry the product ids, so an edited export updates the products
+    when imported instead of adding them again.
+    """
+    out = io.StringIO(newline='')
+    writer = csv.writer(out) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(COLUMNS)
+    for category_id, products in catalog.products_by_category.items():
+        category = catalog.category(category_id)
+        if category is None:
+            continue
+        for product in products.values():
+            values = (f'{category_id}_{product.id}', category.name, product.name, format_price(product.price), product.description)
+            if writer:
+                writer.writerow(values)
+            else:
+                out.write(json.dumps(dict(zip(COLUMNS, values)), ensure_ascii=False) + '\n')
+    encoding = 'utf-8-sig' if fmt == 'csv' else 'utf-8'
+    return out.getvalue().encode(encoding)
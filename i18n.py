@@ -0,0 +1,50 @@
+import json
+import logging
+import os
+import string
+
+logger = logging.getLogger(__name__)
+
+LOCALES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locales')
+
+# Used for users who have not picked a language and for keys a catalog lacks
+DEFAULT_LANG = 'ru'
+
+
+def compile_template(text):
+    """Turn a message into a function of its ``{field}`` arguments."""
+    if any(field is not None for _, field, _, _ in string.Formatter().parse(text)):
+        return text.format
+    return lambda: text
+
+
+class Translations:
+    """Message catalogs, one ``<lang>.json`` file per language.
+
+    Every message is compiled once when the catalogs are loaded; keys a
+    language does not define fall back to the default language, so
+    rendering is a single dictionary lookup and call.
+    """
+
+    def __init__(self, catalogs, default=DEFAULT_LANG):
+        self.default = default
+        base = catalogs[default]
+        self._templates = {
+            lang: {key: compile_template(text) for key, text in {**base, **messages}.items()}
+            for lang, messages in catalogs.items()
+        }
+
+    @classmethod
+    def load(cls, directory=LOCALES_DIR, default=DEFAULT_LANG):
+        catalogs = {}
+        for filename in sorted(os.listdir(directory)):
+            lang, ext = os.path.splitext(filename)
+            if ext == '.json':
+                with open(os.path.join(directory, filename), 'r', encoding='utf-8') as f:
+                    catalogs[lang] = json.load(f)
+        logger.info('Loaded languages: %s', ', '.join(catalogs))
+        return cls(catalogs, default)
+
+    def get(self, lang, key, **kwargs):
+        templates = self._templates.get(lang) or self._templates[self.default]
+        return templates[key](**kwargs)
@@ -0,0 +1,72 @@
+import asyncio
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+IMAGES_DIR = 'images'
+
+# Longest side of a stored product photo; Telegram shows photos at most 1280 px
+MAX_SIDE = 1280
+
+
+def prepare_image(data):
+    """Return ``data`` as a JPEG no larger than MAX_SIDE with the metadata dropped.
+
+    Raises ValueError when Pillow is missing or the bytes are not an image.
+    """
+    if Image is None:
+        raise ValueError('Pillow is not installed')
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # Apply the EXIF rotation before the EXIF block is dropped
+            image = ImageOps.exif_transpose(image).convert('RGB')
+    except OSError as e:
+        raise ValueError(str(e)) from None
+    image.thumbnail((MAX_SIDE, MAX_SIDE))
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=85, optimize=True)
+    return out.getvalue()
+
+
+class ImageStore:
+    """Product photos prepared in a process pool and saved under IMAGES_DIR.
+
+    Decoding and resizing are CPU bound, so they run in worker processes
+    and never hold up the event loop. The pool is started on first use.
+    """
+
+    def __init__(self, directory=IMAGES_DIR, workers=None):
+        self.directory = directory
+        self.workers = workers
+        self._pool = None
+
+    def path(self, name):
+        return os.path.join(self.directory, f'{name}.jpg')
+
+    async def save(self, name, data):
+        """Prepare ``data`` and store it as ``<name>.jpg``; return its path."""
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers)
+        prepared = await asyncio.get_running_loop().run_in_executor(self._pool, prepare_image, bytes(data))
+        path = self.path(name)
+        await asyncio.to_thread(self._write, path, prepared)
+        return path
+
+    def _write(self, path, data):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
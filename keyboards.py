@@ -0,0 +1,24 @@
+class MenuCache:
+    """Prebuilt ``(text, reply_markup)`` pairs for frequently shown screens.
+
+    Entries are keyed by (screen, lang, catalog version). ``invalidate()``
+    bumps the version and drops the old entries, so every screen is
+    rebuilt once on its next view after a catalog change.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._cache = {}
+
+    def get(self, build, lang, *args):
+        """Return the cached screen built by ``build(lang, *args)``."""
+        key = ((build.__name__, *args), lang, self.version)
+        screen = self._cache.get(key)
+        if screen is None:
+            screen = self._cache[key] = build(lang, *args)
+        return screen
+
+    def invalidate(self):
+        """Bump the catalog version after the catalog changed."""
+        self.version += 1
+        self._cache.clear()
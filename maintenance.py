@@ -0,0 +1,141 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FILE = 'users-archive.jsonl.gz'
+
+DAY = 24 * 60 * 60
+
+
+def record_size(record):
+    # Bytes the record takes in the stored documents
+    return len(json.dumps(record, ensure_ascii=False, default=lambda obj: obj.to_dict()))
+
+
+def archive_users(path, users):
+    """Append ``users`` to the gzip JSONL archive at ``path``; return the bytes added.
+
+    Each call adds one gzip member, and ``gzip.open()`` reads all of them
+    back as a single stream.
+    """
+    text = ''.join(json.dumps({"user_id": user_id, **user}, ensure_ascii=False) + '\n'
+                   for user_id, user in users.items())
+    data = gzip.compress(text.encode('utf-8'))
+    with open(path, 'ab') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    return len(data)
+
+
+class Maintenance:
+    """Archives inactive users and expires abandoned carts.
+
+    Users carry a ``last_seen`` timestamp. Each run appends the users not
+    seen for ``user_retention`` seconds to a compressed archive and drops
+    them, with their carts, from the store. It also empties the carts of
+    users not seen for ``cart_retention`` seconds and returns their units
+    to the stock. A retention of 0 disables that part. Runs every
+    ``interval`` seconds; users in ``keep`` are never touched.
+    ``on_archived`` is called with the ids of the archived users, to
+    drop whatever else is kept about them.
+    """
+
+    def __init__(self, store, stock, archive_path=ARCHIVE_FILE, user_retention=180 * DAY,
+                 cart_retention=14 * DAY, interval=DAY, keep=(), on_archived=None):
+        self.store = store
+        self.stock = stock
+        self.archive_path = archive_path
+        self.user_retention = user_retention
+        self.cart_retention = cart_retention
+        self.interval = interval
+        self.keep = set(keep)
+        self.on_archived = on_archived
+        self._task = None
+
+    async def run(self):
+        """One pass; returns how many records and bytes it reclaimed."""
+        now = time.time()
+        users, carts = self.store['users'], self.store['carts']
+        inactive, abandoned = {}, []
+        for user_id, user in users.items():
+            if user_id in self.keep:
+                continue
+            last_seen = user.get('last_seen')
+            if last_seen is None:
+                # Saved before last_seen was tracked; the retention starts now
+                user['last_seen'] = int(now)
+                self.store.mark_dirty('users', user_id)
+            elif self.user_retention and now - last_seen >= self.user_retention:
+                inactive[user_id] = (user, last_seen)
+            elif self.cart_retention and now - last_seen >= self.cart_retention and carts.get(user_id):
+                abandoned.append(user_id)
+        # Carts left behind by users removed some other way
+        abandoned += [user_id for user_id in carts if user_id not in users and user_id not in self.keep]
+
+        report = {"users": 0, "user_bytes": 0, "carts": 0, "cart_bytes": 0, "archive_bytes": 0}
+        if inactive:
+            try:
+                report['archive_bytes'] = await asyncio.to_thread(
+                    archive_users, self.archive_path, {user_id: user for user_id, (user, _) in inactive.items()})
+            except OSError:
+                logger.exception('Failed to archive inactive users, will retry on the next run')
+                inactive = {}
+
+        lines, archived = [], []
+        for user_id, (user, last_seen) in inactive.items():
+            # Skip anyone who came back while the archive was written
+            if users.get(user_id) is not user or user.get('last_seen') != last_seen:
+                continue
+            del users[user_id]
+            self.store.mark_dirty('users', user_id)
+            report['users'] += 1
+            report['user_bytes'] += record_size(user)
+            archived.append(user_id)
+            abandoned.append(user_id)
+        if archived and self.on_archived is not None:
+            self.on_archived(archived)
+        for user_id in abandoned:
+            cart = carts.pop(user_id, None)
+            if not cart:
+                continue
+            self.store.mark_dirty('carts', user_id)
+            report['carts'] += 1
+            report['cart_bytes'] += record_size(cart)
+            lines += [line for _, line in cart]
+        for line in lines:
+            await self.stock.put_back(line['category_id'], line['product_id'], line['quantity'])
+
+        metrics.count_compacted('users', report['users'], report['user_bytes'])
+        metrics.count_compacted('carts', report['carts'], report['cart_bytes'])
+        logger.info('Maintenance archived %s users (%s bytes, %s compressed) and expired %s carts (%s bytes)',
+                    report['users'], report['user_bytes'], report['archive_bytes'],
+                    report['carts'], report['cart_bytes'])
+        return report
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run()
+            except Exception:
+                logger.exception('Maintenance run failed')
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
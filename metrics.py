@@ -0,0 +1,195 @@
+import asyncio
+import contextvars
+import logging
+import time
+from collections import Counter, defaultdict, deque
+
+logger = logging.getLogger(__name__)
+
+# Latency samples kept per series for the percentiles
+SAMPLE_SIZE = 2048
+
+# Bot API calls made by the handler running in the current task, see timed()
+_handler_api_calls = contextvars.ContextVar('handler_api_calls', default=None)
+
+
+class Histogram:
+    """Call count, total time and a window of recent latency samples."""
+
+    def __init__(self, size=SAMPLE_SIZE):
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=size)
+
+    def observe(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.samples.append(seconds)
+
+    def merge(self, count, total, samples):
+        """Add another histogram's figures, e.g. one from another process."""
+        self.count += count
+        self.total += total
+        self.samples.extend(samples)
+
+    def percentiles(self, *ps):
+        samples = sorted(self.samples)
+        if not samples:
+            return [0.0 for _ in ps]
+        return [samples[min(len(samples) - 1, int(p * len(samples)))] for p in ps]
+
+
+class Metrics:
+    """Process-wide handler, storage and Bot API measurements."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.handlers = defaultdict(Histogram)
+        # handler -> Bot API calls made while it ran
+        self.handler_api_calls = Counter()
+        self.api_calls = defaultdict(Histogram)
+        # (operation, collection) -> [calls, bytes]
+        self.io = defaultdict(lambda: [0, 0])
+        # reason -> updates dropped before reaching a handler
+        self.dropped = Counter()
+        # kind -> [records, bytes] removed by the maintenance job
+        self.compacted = defaultdict(lambda: [0, 0])
+
+    def observe_handler(self, name, seconds, api_calls=0):
+        self.handlers[name].observe(seconds)
+        self.handler_api_calls[name] += api_calls
+
+    def observe_api(self, endpoint, seconds):
+        self.api_calls[endpoint].observe(seconds)
+        calls = _handler_api_calls.get()
+        if calls is not None:
+            calls[0] += 1
+
+    def api_calls_per_update(self, name):
+        """Average Bot API calls one run of handler ``name`` made."""
+        count = self.handlers[name].count
+        return self.handler_api_calls[name] / count if count else 0.0
+
+    def count_io(self, operation, name, nbytes):
+        entry = self.io[(operation, name)]
+        entry[0] += 1
+        entry[1] += nbytes
+
+    def count_dropped(self, reason):
+        self.dropped[reason] += 1
+
+    def count_compacted(self, kind, records, nbytes):
+        entry = self.compacted[kind]
+        entry[0] += records
+        entry[1] += nbytes
+
+    def report(self):
+        """Plain-text summary for the /stats command."""
+        lines = [f"Uptime: {int(time.time() - self.started)} s", "", "Handlers (calls, p50/p95/p99 ms):"]
+        lines += self._latency_lines(self.handlers)
+        lines += ["", "Storage (calls, bytes):"]
+        for (operation, name), (calls, nbytes) in sorted(self.io.items()):
+            lines.append(f"{operation} {name}: {calls}, {nbytes}")
+        lines += ["", "Bot API (calls, p50/p95/p99 ms):"]
+        lines += self._latency_lines(self.api_calls)
+        lines += ["", "Bot API calls per update, by handler:"]
+        lines += [f"{name}: {self.api_calls_per_update(name):.2f}" for name in sorted(self.handlers)]
+        if self.dropped:
+            lines += ["", "Dropped updates:"]
+            lines += [f"{reason}: {count}" for reason, count in sorted(self.dropped.items())]
+        if self.compacted:
+            lines += ["", "Compacted (records, bytes):"]
+            lines += [f"{kind}: {records}, {nbytes}" for kind, (records, nbytes) in sorted(self.compacted.items())]
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _latency_lines(series):
+        lines = []
+        for name, histogram in sorted(series.items()):
+            p50, p95, p99 = (s * 1000 for s in histogram.percentiles(0.5, 0.95, 0.99))
+            lines.append(f"{name}: {histogram.count}, {p50:.1f}/{p95:.1f}/{p99:.1f}")
+        return lines
+
+    def prometheus(self):
+        """Metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric, label, series in (
+                ('bot_handler_seconds', 'handler', self.handlers),
+                ('bot_api_call_seconds', 'method', self.api_calls)):
+            lines.append(f'# TYPE {metric} summary')
+            for name, histogram in sorted(series.items()):
+                for q, value in zip(('0.5', '0.95', '0.99'), histogram.percentiles(0.5, 0.95, 0.99)):
+                    lines.append(f'{metric}{{{label}="{name}",quantile="{q}"}} {value:.6f}')
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {histogram.total:.6f}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {histogram.count}')
+        lines.append('# TYPE bot_handler_api_calls_total counter')
+        for name, count in sorted(self.handler_api_calls.items()):
+            lines.append(f'bot_handler_api_calls_total{{handler="{name}"}} {count}')
+        io = sorted(self.io.items())
+        for index, metric in enumerate(('bot_storage_calls_total', 'bot_storage_bytes_total')):
+            lines.append(f'# TYPE {metric} counter')
+            for (operation, name), values in io:
+                lines.append(f'{metric}{{operation="{operation}",collection="{name}"}} {values[index]}')
+        lines.append('# TYPE bot_updates_dropped_total counter')
+        for reason, count in sorted(self.dropped.items()):
+            lines.append(f'bot_updates_dropped_total{{reason="{reason}"}} {count}')
+        compacted = sorted(self.compacted.items())
+        for index, metric in enumerate(('bot_compacted_records_total', 'bot_compacted_bytes_total')):
+            lines.append(f'# TYPE {metric} counter')
+            for kind, values in compacted:
+                lines.append(f'{metric}{{kind="{kind}"}} {values[index]}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def timed(callback):
+    """Wrap a handler callback so its latency and Bot API calls are recorded under its name."""
+    name = callback.__name__
+
+    async def wrapper(update, context):
+        start = time.perf_counter()
+        calls = [0]
+        token = _handler_api_calls.set(calls)
+        try:
+            return await callback(update, context)
+        finally:
+            _handler_api_calls.reset(token)
+            metrics.observe_handler(name, time.perf_counter() - start, calls[0])
+
+    wrapper.__name__ = name
+    wrapper.__wrapped__ = callback
+    return wrapper
+
+
+async def _handle_scrape(reader, writer):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        if request_line.split(b' ')[1:2] == [b'/metrics']:
+            status, body = '200 OK', metrics.prometheus().encode()
+        else:
+            status, body = '404 Not Found', b''
+        writer.write(
+            f'HTTP/1.1 {status}\r\n'
+            f'Content-Type: text/plain; version=0.0.4\r\n'
+            f'Content-Length: {len(body)}\r\n'
+            f'Connection: close\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_metrics(host, port):
+    """Serve ``GET /metrics`` for Prometheus; returns the asyncio server."""
+    server = await asyncio.start_server(_handle_scrape, host, port)
+    logger.info('Metrics available at http://%s:%s/metrics', host, port)
+    return server
@@ -0,0 +1,213 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+
+from telegram.error import RetryAfter, TelegramError
+
+from broadcast import retry_seconds
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects messages longer than this
+MESSAGE_LIMIT = 4096
+
+
+class OrderLog:
+    """Append-only JSONL log of orders.
+
+    Every order is written as ``{"order": {...}}`` and, once the admin has
+    been told about it, ``{"notified": [ids]}`` is appended. Replaying the
+    file on startup gives back the orders and the ones still waiting for a
+    notification. Appends are fsynced, so an order confirmed to the user
+    survives a crash; records appended while a write is in progress are
+    written together with one fsync.
+
+    Order ids are ``first_id``, ``first_id + id_step``, ... so that logs
+    written side by side by several worker processes never share an id.
+    """
+
+    def __init__(self, path, first_id=1, id_step=1):
+        self.path = path
+        self.first_id = first_id
+        self.id_step = id_step
+        self.orders = {}
+        self.last_id = 0
+        self._notified = set()
+        # Records waiting for the next write, with the futures of their callers
+        self._buffer = []
+        self._writer = None
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash
+                    continue
+                if 'order' in record:
+                    order = record['order']
+                    self.orders[order['id']] = order
+                    self.last_id = max(self.last_id, order['id'])
+                else:
+                    self._notified.update(record.get('notified', ()))
+        logger.info('Loaded %s orders', len(self.orders))
+
+    def pending(self):
+        """Orders the admin has not been notified about, oldest first."""
+        return [order for order_id, order in sorted(self.orders.items()) if order_id not in self._notified]
+
+    def _write(self, records):
+        data = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def _write_buffered(self):
+        while self._buffer:
+            batch, self._buffer = self._buffer, []
+            try:
+                await asyncio.to_thread(self._write, [record for record, _ in batch])
+            except OSError as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for _, future in batch:
+                    future.set_result(None)
+        self._writer = None
+
+    async def _append(self, record):
+        future = asyncio.get_running_loop().create_future()
+        self._buffer.append((record, future))
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_buffered())
+        await future
+
+    async def create(self, user_id, phone, address, cart):
+        """Snapshot ``cart`` into a new order and append it to the log."""
+        self.last_id = self.last_id + self.id_step if self.last_id else self.first_id
+        order = {
+            "id": self.last_id,
+            "user_id": user_id,
+            "phone": phone,
+            "address": address,
+            "lines": [
+                {
+                    "category_id": line['category_id'],
+                    "product_id": line['product_id'],
+                    "name": line['name'],
+                    "price": line['price'],
+                    "quantity": line['quantity']
+                }
+                for _, line in cart
+            ],
+            "total": cart.total,
+            "created": datetime.now().isoformat(timespec='seconds')
+        }
+        self.orders[order['id']] = order
+        await self._append({"order": order})
+        return order
+
+    async def mark_notified(self, order_ids):
+        self._notified.update(order_ids)
+        await self._append({"notified": list(order_ids)})
+
+
+def chunk_text(parts, limit=MESSAGE_LIMIT):
+    """Join ``parts`` with blank lines into as few messages as fit in ``limit``."""
+    chunks, current = [], ''
+    for part in parts:
+        part = part[:limit]
+        if current and len(current) + 2 + len(part) > limit:
+            chunks.append(current)
+            current = ''
+        current = f"{current}\n\n{part}" if current else part
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class OrderNotifier:
+    """Tells the admin about new orders from a background task.
+
+    Checkout only puts the order on a queue. The worker waits
+    ``batch_window`` seconds for more orders to arrive and sends them
+    together, so a burst of orders costs a few messages instead of one
+    per order. When sending fails the batch is retried after a delay
+    that doubles up to ``max_retry_delay`` seconds; until it goes
+    through its orders stay pending in the log, so a restart sends them
+    again.
+    """
+
+    def __init__(self, bot, chat_id, log, format_order, batch_window=2.0, max_batch=20,
+                 retry_delay=1.0, max_retry_delay=300.0):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.log = log
+        self.format_order = format_order
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._queue = asyncio.Queue()
+        self._task = None
+
+    def submit(self, order):
+        self._queue.put_nowait(order)
+
+    def start(self, pending=()):
+        for order in pending:
+            self.submit(order)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _next_batch(self):
+        batch = [await self._queue.get()]
+        # Let the rest of a burst arrive before sending
+        await asyncio.sleep(self.batch_window)
+        while len(batch) < self.max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _send(self, text):
+        while True:
+            try:
+                await self.bot.send_message(chat_id=self.chat_id, text=text)
+                return
+            except RetryAfter as e:
+                await asyncio.sleep(retry_seconds(e))
+
+    async def _deliver(self, batch):
+        # Messages already sent are not sent again when a later one is retried
+        messages = chunk_text([self.format_order(order) for order in batch])
+        delay = self.retry_delay
+        while messages:
+            try:
+                await self._send(messages[0])
+            except TelegramError as e:
+                logger.warning('Could not notify the admin about %s orders, retrying in %s s: %s',
+                               len(batch), delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            messages.pop(0)
+            delay = self.retry_delay
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            await self._deliver(batch)
+            await self.log.mark_notified([order['id'] for order in batch])
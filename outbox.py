@@ -0,0 +1,84 @@
+import asyncio
+import contextvars
+import logging
+
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Edits collected for the handler running in the current task, see Outbox.collect()
+_pending = contextvars.ContextVar('outbox_pending', default=None)
+
+
+class Outbox:
+    """Outgoing message edits, merged per update and sent in order per chat.
+
+    Inside a handler wrapped by ``collect()``, an ``edit()`` replaces any
+    edit of the same message queued earlier in that update, and only the
+    last one is sent when the handler returns, so a handler that redraws
+    a message several times costs one Bot API call. Outside ``collect()``
+    edits are sent at once.
+
+    Sends to one chat go out one at a time. When Telegram answers with a
+    flood-control error (RetryAfter) the chat waits as long as asked and
+    the edit is retried, unless a newer edit of the same message has
+    queued up behind it in the meantime, in which case only that one is
+    sent.
+    """
+
+    def __init__(self, deliver):
+        # async deliver(query, text, reply_markup) performs one edit
+        self.deliver = deliver
+        self._chats = {}   # chat id -> [lock, number of sends using it]
+        self._latest = {}  # (chat id, message id) -> newest edit waiting to be sent
+
+    async def edit(self, query, text, reply_markup=None):
+        edit = (query, text, reply_markup)
+        pending = _pending.get()
+        if pending is not None and query.message is not None:
+            pending[(query.message.chat_id, query.message.message_id)] = edit
+        else:
+            await self._send(edit)
+
+    def collect(self, callback):
+        """Wrap a handler callback so its edits are merged and sent when it returns."""
+        async def wrapper(update, context):
+            pending = {}
+            token = _pending.set(pending)
+            try:
+                result = await callback(update, context)
+            finally:
+                _pending.reset(token)
+            for edit in pending.values():
+                await self._send(edit)
+            return result
+
+        wrapper.__name__ = callback.__name__
+        wrapper.__wrapped__ = callback
+        return wrapper
+
+    async def _send(self, edit):
+        message = edit[0].message
+        if message is None:
+            await self.deliver(*edit)
+            return
+        key = (message.chat_id, message.message_id)
+        self._latest[key] = edit
+        chat = self._chats.setdefault(message.chat_id, [asyncio.Lock(), 0])
+        chat[1] += 1
+        try:
+            async with chat[0]:
+                while self._latest.get(key) is edit:
+                    try:
+                        await self.deliver(*edit)
+                    except RetryAfter as e:
+                        logger.warning('Flood control on chat %s, waiting %s s', message.chat_id, e.retry_after)
+                        await asyncio.sleep(e.retry_after)
+                    else:
+                        break
+        finally:
+            if self._latest.get(key) is edit:
+                del self._latest[key]
+            chat[1] -= 1
+            if not chat[1]:
+                del self._chats[message.chat_id]
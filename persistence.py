@@ -0,0 +1,105 @@
+from telegram.ext import BasePersistence, PersistenceInput
+
+from storage import DataStore
+
+SESSION_NAMES = ('conversations', 'user_data')
+
+
+def encode_key(key):
+    # Conversation keys are tuples of chat/user ids
+    return ','.join(str(part) for part in key)
+
+
+def decode_key(text):
+    return tuple(int(part) for part in text.split(','))
+
+
+class StorePersistence(BasePersistence):
+    """Conversation states and ``user_data`` kept in a DataStore.
+
+    The application reports only the conversations and users that changed
+    since its last persistence run, and each of them is marked dirty on
+    its own, so the SQLite backend writes just those rows. The sessions
+    are read from the backend once, the first time the application asks
+    for them, and written back by the store's flush task.
+    """
+
+    def __init__(self, backend, flush_interval=5.0, update_interval=5.0):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval
+        )
+        self.store = DataStore(backend, SESSION_NAMES, flush_interval=flush_interval)
+        self._loaded = False
+
+    async def _sessions(self, name):
+        if not self._loaded:
+            self._loaded = True
+            await self.store.load()
+            self.store.start()
+        return self.store[name]
+
+    async def get_conversations(self, name):
+        states = (await self._sessions('conversations')).get(name, {})
+        return {decode_key(key): state for key, state in states.items()}
+
+    async def update_conversation(self, name, key, new_state):
+        states = (await self._sessions('conversations')).setdefault(name, {})
+        key = encode_key(key)
+        if new_state is None:
+            if states.pop(key, None) is None:
+                return
+        else:
+            states[key] = new_state
+        self.store.mark_dirty('conversations', (name, key))
+
+    async def get_user_data(self):
+        return {int(user_id): data for user_id, data in (await self._sessions('user_data')).items()}
+
+    async def update_user_data(self, user_id, data):
+        user_data = await self._sessions('user_data')
+        user_id = str(user_id)
+        if data:
+            user_data[user_id] = data
+        elif user_data.pop(user_id, None) is None:
+            # Most users never store anything; keep them out of the table
+            return
+        self.store.mark_dirty('user_data', user_id)
+
+    async def drop_user_data(self, user_id):
+        await self.update_user_data(user_id, {})
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def flush(self):
+        if self._loaded:
+            await self.store.stop()
+            self._loaded = False
@@ -0,0 +1,67 @@
+import bisect
+import re
+
+# Uzbek Latin is written with several apostrophe look-alikes (o‘, g’, ...)
+APOSTROPHES = str.maketrans({c: "'" for c in "ʻʼ‘’`´"})
+TOKEN_RE = re.compile(r"\w[\w']*")
+
+
+def normalize(text):
+    return text.translate(APOSTROPHES).casefold().replace('ё', 'е')
+
+
+def tokenize(text):
+    return {token.rstrip("'") for token in TOKEN_RE.findall(normalize(text))}
+
+
+class SearchIndex:
+    """Inverted index over product names and descriptions.
+
+    Matching is case-insensitive and every query word is treated as a
+    prefix, so "iph 13" finds "iPhone 13". Products are added and removed
+    one at a time; the index is never rebuilt per query.
+    """
+
+    def __init__(self):
+        self._postings = {}   # token -> set of keys
+        self._tokens = []     # sorted list of indexed tokens for prefix lookups
+        self._by_key = {}     # key -> tokens, so products can be re-indexed
+
+    def add(self, key, *texts):
+        self.remove(key)
+        tokens = set()
+        for text in texts:
+            tokens |= tokenize(text)
+        for token in tokens:
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = set()
+                bisect.insort(self._tokens, token)
+            postings.add(key)
+        self._by_key[key] = tokens
+
+    def remove(self, key):
+        for token in self._by_key.pop(key, ()):
+            postings = self._postings[token]
+            postings.discard(key)
+            if not postings:
+                del self._postings[token]
+                del self._tokens[bisect.bisect_left(self._tokens, token)]
+
+    def _prefix_matches(self, prefix):
+        keys = set()
+        i = bisect.bisect_left(self._tokens, prefix)
+        while i < len(self._tokens) and self._tokens[i].startswith(prefix):
+            keys |= self._postings[self._tokens[i]]
+            i += 1
+        return keys
+
+    def search(self, query):
+        """Return the keys matching every word of ``query``."""
+        result = None
+        for word in sorted(tokenize(query), key=len, reverse=True):
+            keys = self._prefix_matches(word)
+            result = keys if result is None else result & keys
+            if not result:
+                return set()
+        return result or set()
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.error import TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Update fields whose object names the user who caused the update
+USER_FIELDS = (
+    'message', 'edited_message', 'callback_query', 'inline_query', 'chosen_inline_result',
+    'shipping_query', 'pre_checkout_query', 'poll_answer', 'my_chat_member', 'chat_member',
+    'chat_join_request',
+)
+
+
+def update_user_id(data):
+    """User id of a raw update dict, or None for updates without a user."""
+    for field in USER_FIELDS:
+        part = data.get(field)
+        if part:
+            user = part.get('from') or part.get('user')
+            if user:
+                return user['id']
+    return None
+
+
+def shard_for(user_id, count):
+    return (user_id or 0) % count
+
+
+class ShardRouter:
+    """Splits batches of raw updates between worker queues by user id.
+
+    Every user always lands on the same worker, which keeps that user's
+    conversation state and data. Updates without a user go to worker 0.
+    """
+
+    def __init__(self, queues):
+        self.queues = queues
+
+    def dispatch(self, updates):
+        batches = [[] for _ in self.queues]
+        for data in updates:
+            batches[shard_for(update_user_id(data), len(batches))].append(data)
+        for queue, batch in zip(self.queues, batches):
+            if batch:
+                queue.put(batch)
+
+    def close(self):
+        for queue in self.queues:
+            queue.put(None)
+
+
+class OrderedDispatcher:
+    """Processes updates concurrently, but each user's in arrival order.
+
+    An update waits for the previous update of the same user before it
+    runs; updates of different users run side by side, at most
+    ``concurrency`` at a time.
+    """
+
+    def __init__(self, process, concurrency=256):
+        self.process = process
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tails = {}  # user id -> task of that user's latest update
+
+    def submit(self, user_id, item):
+        previous = self._tails.get(user_id)
+        self._tails[user_id] = asyncio.create_task(self._run(user_id, previous, item))
+
+    async def _run(self, user_id, previous, item):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            async with self._semaphore:
+                await self.process(item)
+        except Exception:
+            logger.exception('Failed to process an update')
+        finally:
+            if self._tails.get(user_id) is asyncio.current_task():
+                del self._tails[user_id]
+
+    async def join(self):
+        while self._tails:
+            await asyncio.wait(list(self._tails.values()))
+
+
+async def consume(queue, process):
+    """Feed batches from a multiprocessing ``queue`` to ``process`` until None arrives."""
+    dispatcher = OrderedDispatcher(process)
+    while True:
+        batch = await asyncio.to_thread(queue.get)
+        if batch is None:
+            break
+        for data in batch:
+            dispatcher.submit(update_user_id(data), data)
+    await dispatcher.join()
+
+
+async def poll_updates(bot, handle_updates, timeout=30):
+    """Long-poll getUpdates and pass each batch of raw updates to ``handle_updates``."""
+    offset = None
+    try:
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=Update.ALL_TYPES)
+            except TelegramError as e:
+                logger.warning('getUpdates failed: %s', e)
+                await asyncio.sleep(1)
+                continue
+            if updates:
+                offset = updates[-1].update_id + 1
+                await handle_updates([update.to_dict() for update in updates])
+    finally:
+        if offset is not None:
+            # Confirm the last batch so it is not delivered again after a restart
+            try:
+                await bot.get_updates(offset=offset, timeout=0)
+            except TelegramError as e:
+                logger.warning('Could not confirm the last updates: %s', e)
@@ -0,0 +1,73 @@
+import asyncio
+
+from cart import line_key
+
+
+class Stock:
+    """Units left of the products whose stock is tracked.
+
+    Counts are kept in the store's ``stock`` collection, keyed like cart
+    lines; a product without an entry is not tracked and never runs out.
+    ``take()`` checks and decrements without awaiting in between, so two
+    shoppers served by the same event loop cannot both get the last unit.
+    """
+
+    def __init__(self, store):
+        self.store = store
+
+    async def left(self, category_id, product_id):
+        """Units left, or None when the product's stock is not tracked."""
+        return self.store['stock'].get(line_key(category_id, product_id))
+
+    async def take(self, category_id, product_id, quantity=1):
+        """Reserve ``quantity`` units; False when fewer are left."""
+        key = line_key(category_id, product_id)
+        stock = self.store['stock']
+        left = stock.get(key)
+        if left is None:
+            return True
+        if left < quantity:
+            return False
+        stock[key] = left - quantity
+        self.store.mark_dirty('stock', key)
+        return True
+
+    async def put_back(self, category_id, product_id, quantity=1):
+        key = line_key(category_id, product_id)
+        stock = self.store['stock']
+        if key in stock:
+            stock[key] += quantity
+            self.store.mark_dirty('stock', key)
+
+    async def set(self, category_id, product_id, quantity):
+        """Set the units left; None stops tracking the product's stock."""
+        key = line_key(category_id, product_id)
+        if quantity is None:
+            self.store['stock'].pop(key, None)
+        else:
+            self.store['stock'][key] = quantity
+        self.store.mark_dirty('stock', key)
+
+
+class SharedStock:
+    """Stock counts read and changed directly in the SQLite database.
+
+    Used when several worker processes sell from the same stock: nothing
+    is cached, and every change is one conditional UPDATE, so the workers
+    never oversell between them.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    async def left(self, category_id, product_id):
+        return await asyncio.to_thread(self.backend.stock_left, line_key(category_id, product_id))
+
+    async def take(self, category_id, product_id, quantity=1):
+        return await asyncio.to_thread(self.backend.adjust_stock, line_key(category_id, product_id), -quantity)
+
+    async def put_back(self, category_id, product_id, quantity=1):
+        await asyncio.to_thread(self.backend.adjust_stock, line_key(category_id, product_id), quantity)
+
+    async def set(self, category_id, product_id, quantity):
+        await asyncio.to_thread(self.backend.set_stock, line_key(category_id, product_id), quantity)
@@ -0,0 +1,670 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Whole-document marker in the set of changed keys
+ALL = None
+
+
+def to_plain(obj):
+    """``json.dumps`` default hook for in-memory models such as Cart."""
+    try:
+        return obj.to_dict()
+    except AttributeError:
+        raise TypeError(f'{type(obj).__name__} is not JSON serializable') from None
+
+
+def load_data(filename):
+    with open(filename, 'rb') as f:
+        raw = f.read()
+    metrics.count_io('load_data', filename, len(raw))
+    return json.loads(raw)
+
+
+def dump_json(data, compact=False):
+    if compact:
+        return json.dumps(data, separators=(',', ':'), default=to_plain)
+    return json.dumps(data, indent=4, default=to_plain)
+
+
+def save_data(data, filename, compact=False):
+    write_text(filename, dump_json(data, compact))
+
+
+class AtomicWriter:
+    """Replaces files atomically: temp file, fsync, rename.
+
+    A reader, or the next start after a crash, sees either the old or
+    the new contents, never a truncated file. Writes to one file are
+    serialized by a per-file lock, and a write that arrives while
+    another is in progress only leaves its text behind: whoever gets the
+    lock next writes the latest text once, so a burst of writes costs
+    one fsync instead of one each.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = {}  # filename -> [lock, latest text not yet written]
+
+    def write(self, filename, text):
+        with self._lock:
+            state = self._files.setdefault(filename, [threading.Lock(), None])
+            state[1] = text
+        with state[0]:
+            with self._lock:
+                text, state[1] = state[1], None
+            if text is None:
+                # Written by the call that held the lock before us
+                return
+            try:
+                self._replace(filename, text.encode('utf-8'))
+            except OSError:
+                # Leave the text for the next writer unless a newer one is waiting
+                with self._lock:
+                    if state[1] is None:
+                        state[1] = text
+                raise
+
+    def _replace(self, filename, raw):
+        directory = os.path.dirname(os.path.abspath(filename))
+        tmp = f'{filename}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(raw)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, filename)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        # Make the rename itself durable
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        metrics.count_io('save_data', filename, len(raw))
+
+
+_writer = AtomicWriter()
+
+
+def write_text(filename, text):
+    _writer.write(filename, text)
+
+
+class JsonBackend:
+    """One JSON document per collection, rewritten as a whole on save.
+
+    ``compact`` drops the indentation, which makes the files about a
+    third smaller.
+    """
+
+    def __init__(self, files, compact=False):
+        # name -> (filename, default document)
+        self.files = dict(files)
+        self.compact = compact
+
+    def load(self, name):
+        filename, default = self.files[name]
+        if os.path.exists(filename):
+            return load_data(filename)
+        return json.loads(json.dumps(default))
+
+    def encode(self, name, document, keys):
+        return dump_json(document, self.compact)
+
+    def write(self, name, payload):
+        write_text(self.files[name][0], payload)
+
+    def close(self):
+        pass
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    lang TEXT,
+    data TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE IF NOT EXISTS categories (
+    category_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS products (
+    category_id TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    price INTEGER NOT NULL,
+    description TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (category_id, product_id)
+);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cart_lines (
+    user_id TEXT NOT NULL,
+    category_id TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    price INTEGER NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (user_id, category_id, product_id)
+);
+CREATE TABLE IF NOT EXISTS conversations (
+    name TEXT NOT NULL,
+    conversation_key TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (name, conversation_key)
+);
+CREATE TABLE IF NOT EXISTS user_data (
+    user_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS stock (
+    category_id TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (category_id, product_id)
+);
+CREATE TABLE IF NOT EXISTS photos (
+    image TEXT PRIMARY KEY,
+    file_id TEXT NOT NULL
+);
+"""
+
+# Carts used to be stored one row per tap in cart_items
+MIGRATE_CART_ITEMS = """
+INSERT OR IGNORE INTO cart_lines (user_id, category_id, product_id, name, price, quantity)
+SELECT user_id, category_id, product_id, name, CAST(REPLACE(price, ' ', '') AS INTEGER), SUM(quantity)
+FROM cart_items GROUP BY user_id, category_id, product_id;
+DROP TABLE cart_items;
+"""
+
+# Schema version 1 keeps product and cart prices in tiyin instead of so'm
+MIGRATE_PRICES_TO_TIYIN = """
+UPDATE products SET price = CAST(REPLACE(price, ' ', '') AS INTEGER) * 100;
+UPDATE cart_lines SET price = price * 100;
+PRAGMA user_version = 1;
+"""
+
+# Schema version 2 gives products an optional photo
+MIGRATE_PRODUCT_IMAGES = """
+ALTER TABLE products ADD COLUMN image TEXT;
+ALTER TABLE products ADD COLUMN image_file_id TEXT;
+PRAGMA user_version = 2;
+"""
+
+# Schema version 3 lets the admin hide a product
+MIGRATE_PRODUCT_AVAILABLE = """
+ALTER TABLE products ADD COLUMN available INTEGER NOT NULL DEFAULT 1;
+PRAGMA user_version = 3;
+"""
+
+
+class SqliteBackend:
+    """Row-per-record storage in a single SQLite database.
+
+    The in-memory documents keep the same shape as the JSON files; only
+    the records named in ``keys`` are written on save, so changing one
+    user's cart touches that user's rows only.
+
+    With ``shard=(index, count)`` only the users whose id is ``index``
+    modulo ``count`` are loaded, which lets several worker processes
+    share one database, each owning its own users' rows.
+    """
+
+    # Tables holding each collection
+    TABLES = {
+        'users': ('users',),
+        'products': ('products', 'categories'),
+        'carts': ('cart_lines',),
+        'conversations': ('conversations',),
+        'user_data': ('user_data',),
+        'stock': ('stock',),
+        'photos': ('photos',),
+    }
+
+    def __init__(self, path, shard=None):
+        self.path = path
+        self.shard = shard
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        tables = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if 'cart_items' in tables:
+            self.conn.executescript(MIGRATE_CART_ITEMS)
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < 1:
+            self.conn.executescript(MIGRATE_PRICES_TO_TIYIN)
+        if version < 2:
+            self.conn.executescript(MIGRATE_PRODUCT_IMAGES)
+        if version < 3:
+            self.conn.executescript(MIGRATE_PRODUCT_AVAILABLE)
+
+    def load(self, name):
+        with self._lock:
+            document = getattr(self, f'_load_{name}')()
+        metrics.count_io('load_data', name, len(json.dumps(document)))
+        return document
+
+    def _where_owned(self, column):
+        """SQL condition and parameters selecting the rows of this shard's users."""
+        if self.shard is None:
+            return '1', ()
+        index, count = self.shard
+        return f'CAST({column} AS INTEGER) % ? = ?', (count, index)
+
+    def _load_users(self):
+        users = {}
+        where, params = self._where_owned('user_id')
+        rows = self.conn.execute(f'SELECT user_id, lang, data FROM users WHERE {where} ORDER BY rowid', params)
+        for user_id, lang, data in rows:
+            users[user_id] = {"lang": lang, **json.loads(data)}
+        return users
+
+    def _load_products(self):
+        document = {"categories": {}, "products": {}}
+        for category_id, name in self.conn.execute('SELECT category_id, name FROM categories ORDER BY rowid'):
+            document['categories'][category_id] = name
+        rows = self.conn.execute(
+            'SELECT category_id, product_id, name, price, description, image, image_file_id, available '
+            'FROM products ORDER BY rowid')
+        for category_id, product_id, name, price, description, image, image_file_id, available in rows:
+            document['products'].setdefault(category_id, {})[product_id] = {
+                "name": name,
+                "price": int(price),
+                "description": description,
+                "image": image,
+                "image_file_id": image_file_id,
+                "available": bool(available)
+            }
+        for name, value in self.conn.execute("SELECT name, value FROM counters WHERE name LIKE 'next_%'"):
+            document[name] = value
+        return document
+
+    def _load_carts(self):
+        carts = {}
+        where, params = self._where_owned('user_id')
+        rows = self.conn.execute(
+            'SELECT user_id, category_id, product_id, name, price, quantity FROM cart_lines '
+            f'WHERE {where} ORDER BY rowid', params)
+        for user_id, category_id, product_id, name, price, quantity in rows:
+            carts.setdefault(user_id, {})[f'{category_id}_{product_id}'] = {
+                "name": name,
+                "unit_price": price,
+                "quantity": quantity
+            }
+        return carts
+
+    def _load_conversations(self):
+        conversations = {}
+        # Keys are "chat_id,user_id"
+        where, params = self._where_owned("substr(conversation_key, instr(conversation_key, ',') + 1)")
+        rows = self.conn.execute(
+            f'SELECT name, conversation_key, state FROM conversations WHERE {where} ORDER BY rowid', params)
+        for name, key, state in rows:
+            conversations.setdefault(name, {})[key] = json.loads(state)
+        return conversations
+
+    def _load_user_data(self):
+        where, params = self._where_owned('user_id')
+        rows = self.conn.execute(f'SELECT user_id, data FROM user_data WHERE {where} ORDER BY rowid', params)
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    def _load_stock(self):
+        rows = self.conn.execute('SELECT category_id, product_id, quantity FROM stock')
+        return {f'{category_id}_{product_id}': quantity for category_id, product_id, quantity in rows}
+
+    def _load_photos(self):
+        return dict(self.conn.execute('SELECT image, file_id FROM photos'))
+
+    def stock_left(self, key):
+        with self._lock:
+            row = self.conn.execute('SELECT quantity FROM stock WHERE category_id = ? AND product_id = ?',
+                                    tuple(key.split('_', 1))).fetchone()
+        return row[0] if row else None
+
+    def adjust_stock(self, key, delta):
+        """Add ``delta`` units to a product's stock unless it would drop below zero.
+
+        A single conditional UPDATE, so processes sharing the database can
+        never sell the same unit twice. Returns False only when too few
+        units are left; products without stock tracking always succeed.
+        """
+        category_id, product_id = key.split('_', 1)
+        with self._lock, self.conn:
+            cursor = self.conn.execute(
+                'UPDATE stock SET quantity = quantity + ? '
+                'WHERE category_id = ? AND product_id = ? AND quantity + ? >= 0',
+                (delta, category_id, product_id, delta))
+            if cursor.rowcount:
+                return True
+            return self.conn.execute('SELECT 1 FROM stock WHERE category_id = ? AND product_id = ?',
+                                     (category_id, product_id)).fetchone() is None
+
+    def set_stock(self, key, quantity):
+        with self._lock, self.conn:
+            for sql, params in self._encode_stock({key: quantity} if quantity is not None else {}, key):
+                self.conn.execute(sql, params)
+
+    def user_ids(self):
+        """Ids of all users, whichever shard they belong to."""
+        with self._lock:
+            return [row[0] for row in self.conn.execute('SELECT user_id FROM users ORDER BY rowid')]
+
+    def catalog_version(self):
+        """Number of times the catalog has been saved, to spot changes made by another process."""
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM counters WHERE name = 'catalog_version'").fetchone()
+        return row[0] if row else 0
+
+    def encode(self, name, document, keys):
+        """Copy the changed records out of ``document`` as SQL statements.
+
+        Runs on the event loop while the document cannot change, so it
+        must not touch the database.
+        """
+        statements = []
+        if ALL in keys:
+            statements = [(f'DELETE FROM {table}', ()) for table in self.TABLES[name]]
+            keys = document.categories if name == 'products' else document
+        for key in keys:
+            statements.extend(getattr(self, f'_encode_{name}')(document, key))
+        if name == 'products':
+            statements.append((
+                "INSERT INTO counters (name, value) VALUES ('catalog_version', 1) "
+                "ON CONFLICT(name) DO UPDATE SET value = value + 1", ()
+            ))
+        return statements
+
+    def _encode_users(self, users, user_id):
+        user = users.get(user_id)
+        if user is None:
+            return [('DELETE FROM users WHERE user_id = ?', (user_id,))]
+        data = {k: v for k, v in user.items() if k != 'lang'}
+        return [(
+            'INSERT INTO users (user_id, lang, data) VALUES (?, ?, ?) '
+            'ON CONFLICT(user_id) DO UPDATE SET lang = excluded.lang, data = excluded.data',
+            (user_id, user.get('lang'), json.dumps(data))
+        )]
+
+    def _encode_products(self, catalog, category_id):
+        statements = [
+            ('INSERT INTO counters (name, value) VALUES (?, ?) '
+             'ON CONFLICT(name) DO UPDATE SET value = excluded.value', (name, value))
+            for name, value in (('next_category_id', catalog.next_category_id),
+                                ('next_product_id', catalog.next_product_id))
+        ]
+        statements.append(('DELETE FROM products WHERE category_id = ?', (category_id,)))
+        category = catalog.category(category_id)
+        if category is None:
+            statements.append(('DELETE FROM categories WHERE category_id = ?', (category_id,)))
+            return statements
+        statements.append((
+            'INSERT INTO categories (category_id, name) VALUES (?, ?) '
+            'ON CONFLICT(category_id) DO UPDATE SET name = excluded.name',
+            (category_id, category.name)
+        ))
+        for product in catalog.products(category_id).values():
+            statements.append((
+                'INSERT INTO products '
+                '(category_id, product_id, name, price, description, image, image_file_id, available) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (category_id, product.id, product.name, product.price, product.description,
+                 product.image, product.image_file_id, int(product.available))
+            ))
+        return statements
+
+    def _encode_carts(self, carts, key):
+        # key is a user id, or (user id, line key) when a single line changed
+        if isinstance(key, tuple):
+            user_id, line = key
+            category_id, product_id = line.split('_', 1)
+            statements = [('DELETE FROM cart_lines WHERE user_id = ? AND category_id = ? AND product_id = ?',
+                           (user_id, category_id, product_id))]
+        else:
+            user_id, line = key, None
+            statements = [('DELETE FROM cart_lines WHERE user_id = ?', (user_id,))]
+        cart = carts.get(user_id)
+        lines = to_plain(cart) if cart is not None else {}
+        if line is not None:
+            lines = {line: lines[line]} if line in lines else {}
+        for line, item in lines.items():
+            category_id, product_id = line.split('_', 1)
+            statements.append((
+                'INSERT INTO cart_lines (user_id, category_id, product_id, name, price, quantity) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (user_id, category_id, product_id, item['name'], item['unit_price'], item['quantity'])
+            ))
+        return statements
+
+    def _encode_conversations(self, conversations, key):
+        # key is a handler name, or (handler name, conversation key) when a single conversation changed
+        if isinstance(key, tuple):
+            name, conversation_key = key
+            statements = [('DELETE FROM conversations WHERE name = ? AND conversation_key = ?',
+                           (name, conversation_key))]
+            states = conversations.get(name, {})
+            states = {conversation_key: states[conversation_key]} if conversation_key in states else {}
+        else:
+            name = key
+            statements = [('DELETE FROM conversations WHERE name = ?', (name,))]
+            states = conversations.get(name, {})
+        for conversation_key, state in states.items():
+            statements.append((
+                'INSERT INTO conversations (name, conversation_key, state) VALUES (?, ?, ?)',
+                (name, conversation_key, json.dumps(state))
+            ))
+        return statements
+
+    def _encode_user_data(self, user_data, user_id):
+        data = user_data.get(user_id)
+        if data is None:
+            return [('DELETE FROM user_data WHERE user_id = ?', (user_id,))]
+        return [(
+            'INSERT INTO user_data (user_id, data) VALUES (?, ?) '
+            'ON CONFLICT(user_id) DO UPDATE SET data = excluded.data',
+            (user_id, json.dumps(data))
+        )]
+
+    def _encode_stock(self, stock, key):
+        quantity = stock.get(key)
+        category_id, product_id = key.split('_', 1)
+        if quantity is None:
+            return [('DELETE FROM stock WHERE category_id = ? AND product_id = ?', (category_id, product_id))]
+        return [(
+            'INSERT INTO stock (category_id, product_id, quantity) VALUES (?, ?, ?) '
+            'ON CONFLICT(category_id, product_id) DO UPDATE SET quantity = excluded.quantity',
+            (category_id, product_id, quantity)
+        )]
+
+    def _encode_photos(self, photos, image):
+        file_id = photos.get(image)
+        if file_id is None:
+            return [('DELETE FROM photos WHERE image = ?', (image,))]
+        return [(
+            'INSERT INTO photos (image, file_id) VALUES (?, ?) '
+            'ON CONFLICT(image) DO UPDATE SET file_id = excluded.file_id',
+            (image, file_id)
+        )]
+
+    def write(self, name, payload):
+        with self._lock, self.conn:
+            for sql, params in payload:
+                self.conn.execute(sql, params)
+        metrics.count_io('save_data', name, sum(len(str(p)) for _, params in payload for p in params))
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class DataStore:
+    """In-memory copy of the bot's data with write-behind persistence.
+
+    Each collection is read from the backend once by ``load()``. Handlers
+    read and modify the in-memory documents directly and call
+    ``mark_dirty()`` afterwards; a background task writes the dirty
+    records back every ``flush_interval`` seconds and ``stop()`` performs
+    a final flush. Backend I/O runs in worker threads so it never blocks
+    the event loop.
+
+    Collections listed in ``read_only`` are loaded but never written back;
+    ``reload()`` reads one again, e.g. after another process changed it.
+    Collections listed in ``lazy`` are skipped by ``load()``: ``preload()``
+    reads them in a worker thread, and one that is used before that has
+    finished is read on the spot.
+    """
+
+    def __init__(self, backend, names, flush_interval=5.0, decoders=None, read_only=(), lazy=()):
+        self.backend = backend
+        self.names = list(names)
+        # name -> function turning the stored document into in-memory objects
+        self.decoders = decoders or {}
+        self.read_only = set(read_only)
+        self.lazy = [name for name in self.names if name in lazy]
+        self.flush_interval = flush_interval
+        self.data = {}
+        self._dirty = {name: set() for name in self.names}
+        self._flush_lock = asyncio.Lock()
+        self._stopping = asyncio.Event()
+        self._task = None
+
+    async def load(self):
+        for name in self.names:
+            if name not in self.lazy:
+                await self.reload(name)
+                logger.info('Loaded %s', name)
+
+    async def preload(self):
+        for name in self.lazy:
+            document = await asyncio.to_thread(self._read, name)
+            # Unless it was needed, and read, in the meantime
+            if name not in self.data:
+                self.data[name] = document
+                logger.info('Loaded %s', name)
+
+    async def reload(self, name):
+        self.data[name] = await asyncio.to_thread(self._read, name)
+
+    def _read(self, name):
+        document = self.backend.load(name)
+        decode = self.decoders.get(name)
+        return decode(document) if decode else document
+
+    def __getitem__(self, name):
+        try:
+            return self.data[name]
+        except KeyError:
+            if name not in self.lazy:
+                raise
+        logger.info('Loading %s on first use', name)
+        document = self.data[name] = self._read(name)
+        return document
+
+    def replace(self, name, document, keys=(ALL,)):
+        """Swap in a new version of a collection, e.g. an edited copy of the catalog.
+
+        Readers holding the old document keep a consistent view of it.
+        """
+        self.data[name] = document
+        for key in keys:
+            self.mark_dirty(name, key)
+
+    def mark_dirty(self, name, key=ALL):
+        """Schedule ``name`` for the next flush.
+
+        ``key`` identifies the changed record (user id, category id, ...);
+        leave it out when the whole document changed.
+        """
+        if name not in self.read_only:
+            self._dirty[name].add(key)
+
+    async def flush(self):
+        async with self._flush_lock:
+            pending = []
+            for name, keys in self._dirty.items():
+                if keys:
+                    payload = self.backend.encode(name, self.data[name], keys)
+                    pending.append((name, keys.copy(), payload))
+                    keys.clear()
+
+            for name, keys, payload in pending:
+                try:
+                    await asyncio.to_thread(self.backend.write, name, payload)
+                except (OSError, sqlite3.Error):
+                    logger.exception('Failed to write %s, will retry', name)
+                    self._dirty[name].update(keys)
+
+    async def _run(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                await self.flush()
+
+    def start(self):
+        self._stopping.clear()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._stopping.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        await self.flush()
+        await asyncio.to_thread(self.backend.close)
+
+
+def migrate_json_to_sqlite(files, db_path, decoders=None):
+    """Copy every collection from the JSON files into the SQLite database."""
+    decoders = decoders or {}
+    source = JsonBackend(files)
+    target = SqliteBackend(db_path)
+    try:
+        for name in files:
+            document = source.load(name)
+            if name in decoders:
+                document = decoders[name](document)
+            target.write(name, target.encode(name, document, {ALL}))
+            logger.info('Imported %s into %s', files[name][0], db_path)
+    finally:
+        target.close()
+
+
+def main():
+    from cart import decode_carts
+    from catalog import decode_catalog
+
+    parser = argparse.ArgumentParser(description='Import the JSON data files into a SQLite database.')
+    parser.add_argument('--users', default='users.json')
+    parser.add_argument('--products', default='products.json')
+    parser.add_argument('--carts', default='carts.json')
+    parser.add_argument('--stock', default='stock.json')
+    parser.add_argument('--db', default='shop.db')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    migrate_json_to_sqlite({
+        'users': (args.users, {}),
+        'products': (args.products, {"categories": {}, "products": {}}),
+        'carts': (args.carts, {}),
+        'stock': (args.stock, {}),
+    }, args.db, decoders={'products': decode_catalog, 'carts': decode_carts})
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+from cart import Cart
+
+
+def test_legacy_item_list_is_merged():
+    cart = Cart.from_dict([
+        {"category_id": '1', "product_id": '1', "name": 'Phone', "price": '12 000', "quantity": 1},
+        {"category_id": '1', "product_id": '2', "name": 'Case', "price": 500, "quantity": 1},
+        {"category_id": '1', "product_id": '1', "name": 'Phone', "price": '12 000', "quantity": 1},
+    ])
+    assert cart.lines['1_1']['price'] == 1200000
+    assert cart.lines['1_1']['quantity'] == 2
+    assert cart.lines['1_2']['price'] == 50000
+    assert cart.total == 2 * 1200000 + 50000
+
+
+def test_legacy_lines_priced_in_som():
+    cart = Cart.from_dict({'1_1': {"name": 'Phone', "price": '12 000', "quantity": 3}})
+    assert cart.lines['1_1']['price'] == 1200000
+    assert cart.total == 3600000
+
+
+def test_stored_form_round_trips():
+    cart = Cart()
+    cart.add('1', '1', 'Phone', 1200000, 2)
+    cart.add('2', '5', 'Case', 50000)
+    restored = Cart.from_dict(cart.to_dict())
+    assert restored.lines == cart.lines
+    assert restored.total == cart.total
@@ -0,0 +1,81 @@
+import sqlite3
+
+from storage import SqliteBackend
+
+# The schema written before carts, prices in tiyin, photos and hidden products
+LEGACY_SCHEMA = """
+CREATE TABLE users (
+    user_id TEXT PRIMARY KEY,
+    lang TEXT,
+    data TEXT NOT NULL DEFAULT '{}'
+);
+CREATE TABLE categories (
+    category_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL
+);
+CREATE TABLE products (
+    category_id TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    price TEXT NOT NULL,
+    description TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (category_id, product_id)
+);
+CREATE TABLE cart_items (
+    user_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    category_id TEXT NOT NULL,
+    product_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    price TEXT NOT NULL,
+    quantity INTEGER NOT NULL,
+    PRIMARY KEY (user_id, position)
+);
+INSERT INTO users (user_id, lang, data) VALUES ('42', 'uz', '{"cart": []}');
+INSERT INTO categories (category_id, name) VALUES ('1', 'Phones');
+INSERT INTO products (category_id, product_id, name, price, description) VALUES
+    ('1', '1', 'Phone', '12 000', ''),
+    ('1', '2', 'Case', '500', 'Leather');
+INSERT INTO cart_items (user_id, position, category_id, product_id, name, price, quantity) VALUES
+    ('42', 0, '1', '1', 'Phone', '12 000', 1),
+    ('42', 1, '1', '2', 'Case', '500', 1),
+    ('42', 2, '1', '1', 'Phone', '12 000', 1);
+"""
+
+
+def legacy_database(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(LEGACY_SCHEMA)
+    conn.close()
+    return path
+
+
+def test_legacy_database_is_migrated(tmp_path):
+    backend = SqliteBackend(legacy_database(str(tmp_path / 'shop.db')))
+
+    products = backend.load('products')['products']['1']
+    assert products['1']['price'] == 1200000
+    assert products['2']['price'] == 50000
+    assert products['2']['description'] == 'Leather'
+    assert products['1']['image'] is None and products['1']['image_file_id'] is None
+    assert products['1']['available'] is True
+
+    assert backend.load('carts') == {'42': {
+        '1_1': {"name": 'Phone', "unit_price": 1200000, "quantity": 2},
+        '1_2': {"name": 'Case', "unit_price": 50000, "quantity": 1},
+    }}
+    assert backend.load('users')['42']['lang'] == 'uz'
+
+    tables = {row[0] for row in backend.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    assert 'cart_items' not in tables
+    assert backend.conn.execute('PRAGMA user_version').fetchone()[0] == 3
+    backend.close()
+
+
+def test_migrations_run_once(tmp_path):
+    path = legacy_database(str(tmp_path / 'shop.db'))
+    SqliteBackend(path).close()
+    backend = SqliteBackend(path)
+    assert backend.load('products')['products']['1']['1']['price'] == 1200000
+    assert backend.load('carts')['42']['1_1']['unit_price'] == 1200000
+    backend.close()
@@ -0,0 +1,66 @@
+import time
+
+# Buckets untouched for this long are full again and can be forgotten
+IDLE_SECONDS = 600
+
+
+class Throttle:
+    """Per-user token buckets plus the callback queries being handled.
+
+    Every user gets a bucket of ``burst`` tokens refilled at ``rate``
+    tokens per second; an update that finds the bucket empty is dropped.
+    ``begin``/``end`` bracket the handling of a callback so that a second
+    identical tap on the same message is dropped while the first one is
+    still running. A ``rate`` of 0 turns the buckets off.
+    """
+
+    def __init__(self, rate, burst, in_flight_timeout=30.0):
+        self.rate = rate
+        self.burst = burst
+        self.in_flight_timeout = in_flight_timeout
+        self._buckets = {}    # user id -> [tokens, last refill time]
+        self._in_flight = {}  # callback key -> start time
+        self._next_prune = time.monotonic() + IDLE_SECONDS
+
+    def allow(self, user_id):
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        if now >= self._next_prune:
+            self._prune(now)
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = [self.burst, now]
+        else:
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+    def _prune(self, now):
+        self._buckets = {
+            user_id: bucket for user_id, bucket in self._buckets.items()
+            if now - bucket[1] < IDLE_SECONDS
+        }
+        # A handler that never reached end() must not block its button forever
+        self._in_flight = {
+            key: started for key, started in self._in_flight.items()
+            if now - started < self.in_flight_timeout
+        }
+        self._next_prune = now + IDLE_SECONDS
+
+    def begin(self, key):
+        """Mark ``key`` as being handled; False if it already is."""
+        now = time.monotonic()
+        if now >= self._next_prune:
+            self._prune(now)
+        started = self._in_flight.get(key)
+        if started is not None and now - started < self.in_flight_timeout:
+            return False
+        self._in_flight[key] = now
+        return True
+
+    def end(self, key):
+        self._in_flight.pop(key, None)
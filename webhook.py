@@ -0,0 +1,195 @@
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'x-telegram-bot-api-secret-token'
+
+REASONS = {
+    200: 'OK',
+    400: 'Bad Request',
+    403: 'Forbidden',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    413: 'Payload Too Large',
+}
+
+
+class WebhookServer:
+    """Small asyncio HTTP server that receives Telegram updates.
+
+    Request bodies are acknowledged as soon as they are read and queued;
+    a single decoder task drains the queue in batches of up to
+    ``batch_size`` bodies and passes the decoded update dicts to
+    ``handle_updates``. A body may hold one update or a JSON array of
+    updates, which makes it easy to replay recorded traffic locally.
+
+    Connections are kept alive between requests and closed after
+    ``idle_timeout`` seconds without one, or when the server stops.
+    """
+
+    def __init__(self, handle_updates, host='0.0.0.0', port=8443, path='/webhook',
+                 secret_token=None, batch_size=100, max_body_size=1024 * 1024, idle_timeout=60):
+        self.handle_updates = handle_updates
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.batch_size = batch_size
+        self.max_body_size = max_body_size
+        self.idle_timeout = idle_timeout
+        self._queue = asyncio.Queue()
+        self._server = None
+        self._decoder = None
+        self._connections = {}  # connection task -> its writer
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self._decoder = asyncio.create_task(self._decode_loop())
+        logger.info('Webhook server listening on %s:%s%s', self.host, self.port, self.path)
+
+    async def stop(self):
+        """Stop accepting requests and deliver everything already queued."""
+        if self._server is not None:
+            self._server.close()
+            # Telegram leaves idle keep-alive connections open; close them so their tasks end
+            connections = list(self._connections.items())
+            for _, writer in connections:
+                writer.close()
+            await asyncio.gather(*(task for task, _ in connections), return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+        if self._decoder is not None:
+            await self._queue.join()
+            self._decoder.cancel()
+            try:
+                await self._decoder
+            except asyncio.CancelledError:
+                pass
+            self._decoder = None
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                try:
+                    request = await asyncio.wait_for(self._read_request(reader), self.idle_timeout)
+                except asyncio.TimeoutError:
+                    break
+                if request is None:
+                    break
+                method, target, headers, body = request
+                status = self._accept(method, target, headers, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                await self._write_response(writer, status, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+            del self._connections[task]
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length > self.max_body_size:
+            # The body is left unread, so the connection cannot be reused
+            return method, target, {**headers, 'connection': 'close'}, None
+        body = await reader.readexactly(length) if length else b''
+        return method, target, headers, body
+
+    def _accept(self, method, target, headers, body):
+        if body is None:
+            return 413
+        if target.split('?', 1)[0] != self.path:
+            return 404
+        if method != 'POST':
+            return 405
+        # Compared as bytes: compare_digest rejects str with non-ASCII characters
+        if self.secret_token and not hmac.compare_digest(
+                headers.get(SECRET_HEADER, '').encode('latin-1'), self.secret_token.encode()):
+            return 403
+        if not body:
+            return 400
+        self._queue.put_nowait(body)
+        return 200
+
+    async def _write_response(self, writer, status, keep_alive):
+        writer.write(
+            f'HTTP/1.1 {status} {REASONS[status]}\r\n'
+            f'Content-Length: 0\r\n'
+            f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1')
+        )
+        await writer.drain()
+
+    async def _decode_loop(self):
+        while True:
+            bodies = [await self._queue.get()]
+            while len(bodies) < self.batch_size and not self._queue.empty():
+                bodies.append(self._queue.get_nowait())
+
+            updates = []
+            for body in bodies:
+                try:
+                    data = json.loads(body)
+                except ValueError:
+                    logger.warning('Dropping malformed webhook body: %r', body[:200])
+                    continue
+                updates.extend(data if isinstance(data, list) else [data])
+
+            try:
+                if updates:
+                    await self.handle_updates(updates)
+            except Exception:
+                logger.exception('Failed to handle %d webhook updates', len(updates))
+            finally:
+                for _ in bodies:
+                    self._queue.task_done()
+
+
+async def serve_forever(server):
+    await server.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the webhook server alone and print received updates.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--path', default='/webhook')
+    parser.add_argument('--secret-token')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    async def print_updates(updates):
+        for update in updates:
+            print(json.dumps(update, ensure_ascii=False))
+
+    server = WebhookServer(print_updates, args.host, args.port, args.path, args.secret_token)
+    try:
+        asyncio.run(serve_forever(server))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()